@@ -0,0 +1,305 @@
+import os
+import copy
+import time
+import numpy as np
+from search import SearchEngine, EPSILON, normalize_rows, l2_from_cosine, rank_top_k, subset_rows
+
+EXACT_THRESHOLD = 50000  # Galleries smaller than this are searched exactly
+NPROBE = 16               # Inverted lists scanned per query; higher = better recall, slower
+KMEANS_ITERATIONS = 20
+TRAIN_POINTS_PER_LIST = 64
+CHUNK_ROWS = 8192         # Rows per block when assigning points to centroids
+COMPACT_RATIO = 0.2       # Compact storage once this share of rows is deleted
+RETRAIN_GROWTH = 2.0      # Retrain once the gallery grows this much past the training size
+SAVE_INTERVAL = 300       # Seconds between saves of incremental changes; reconcile() catches up after a crash
+
+def default_nlist(n):
+    """Number of inverted lists for a gallery of n faces (about 4 * sqrt(n))."""
+    return max(1, int(4 * np.sqrt(n)))
+
+def _assign(vectors, centroids):
+    """Nearest centroid (by cosine) of every normalized vector, computed in blocks."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        labels[start:start + CHUNK_ROWS] = np.argmax(vectors[start:start + CHUNK_ROWS] @ centroids.T, axis=1)
+    return labels
+
+def train_kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on normalized vectors; returns unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * TRAIN_POINTS_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=nlist)
+
+        #  Re-seed empty lists from random points so every list stays useful
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+        centroids, _ = normalize_rows(sums)
+
+    return centroids
+
+class IVFIndex:
+    """Inverted-file ANN index over Facenet embeddings with k-means coarse quantization.
+
+    Queries scan only the nprobe lists whose centroids are closest to the query. Small
+    galleries (below exact_threshold) skip training and are searched exactly.
+
+    add, delete, compact and sync change the index in place, so an index that is being
+    searched is only updated through a copy(), which is then swapped in whole.
+    """
+
+    def __init__(self, image_folder="", nlist=None, nprobe=NPROBE, exact_threshold=EXACT_THRESHOLD):
+        self.image_folder = image_folder
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.exact_threshold = exact_threshold
+        self.names = []
+        self.rows = {}
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.labels = np.zeros(0, dtype=np.int32)
+        self.centroids = None
+        self.lists = []
+        self.trained_size = 0
+        self.unsaved = 0  # Faces added, changed or removed since the last save
+        self.saved_at = time.monotonic()
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    @property
+    def is_exact(self):
+        return self.centroids is None
+
+    @property
+    def needs_retrain(self):
+        """True once the gallery has outgrown the training set or crossed the exact/ANN boundary."""
+        if self.is_exact:
+            return len(self) >= self.exact_threshold
+        return len(self) < self.exact_threshold or len(self) > RETRAIN_GROWTH * self.trained_size
+
+    def build(self, names, embeddings):
+        """Replaces the contents and trains the coarse quantizer if the gallery is large enough."""
+        self.names = list(names)
+        self.rows = {name: i for i, name in enumerate(self.names)}
+        self.vectors, self.norms = normalize_rows(np.asarray(embeddings).reshape(len(self.names), -1))
+        self.alive = np.ones(len(self.names), dtype=bool)
+        self.centroids = None
+
+        if len(self.names) >= self.exact_threshold:
+            nlist = self.nlist or default_nlist(len(self.names))
+            self.centroids = train_kmeans(self.vectors, nlist)
+            self.labels = _assign(self.vectors, self.centroids)
+            self.trained_size = len(self.names)
+        else:
+            self.labels = np.zeros(len(self.names), dtype=np.int32)
+        self._rebuild_lists()
+        return self
+
+    def _rebuild_lists(self):
+        if self.is_exact:
+            self.lists = []
+            return
+        order = np.argsort(self.labels, kind="stable")
+        order = order[self.alive[order]]
+        bounds = np.searchsorted(self.labels[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def add(self, names, embeddings):
+        """Inserts (or replaces) faces without retraining."""
+        names = list(names)
+        if not names:
+            return
+        self.delete([name for name in names if name in self.rows])
+
+        vectors, norms = normalize_rows(np.asarray(embeddings).reshape(len(names), -1))
+        start = len(self.names)
+        self.names.extend(names)
+        self.rows.update({name: start + i for i, name in enumerate(names)})
+        self.vectors = vectors if start == 0 else np.concatenate([self.vectors, vectors])
+        self.norms = np.concatenate([self.norms, norms])
+        self.alive = np.concatenate([self.alive, np.ones(len(names), dtype=bool)])
+
+        labels = _assign(vectors, self.centroids) if not self.is_exact else np.zeros(len(names), dtype=np.int32)
+        self.labels = np.concatenate([self.labels, labels])
+        if not self.is_exact:
+            for i, label in enumerate(labels):
+                self.lists[label] = np.append(self.lists[label], start + i)
+
+    def delete(self, names):
+        """Removes faces by name; storage is compacted once enough rows are dead."""
+        rows = [self.rows.pop(name) for name in names if name in self.rows]
+        if not rows:
+            return
+        self.alive[rows] = False
+        if not self.is_exact:
+            dead = set(rows)
+            for label in set(self.labels[rows].tolist()):
+                self.lists[label] = np.array([row for row in self.lists[label] if row not in dead], dtype=np.int64)
+        if 1 - self.alive.mean() > COMPACT_RATIO:
+            self.compact()
+
+    def compact(self):
+        """Drops deleted rows from storage."""
+        keep = np.flatnonzero(self.alive)
+        self.names = [self.names[i] for i in keep]
+        self.rows = {name: i for i, name in enumerate(self.names)}
+        self.vectors, self.norms, self.labels = self.vectors[keep], self.norms[keep], self.labels[keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self._rebuild_lists()
+
+    def copy(self):
+        """A copy that can be updated while searches go on against this one.
+
+        Arrays that updates replace rather than modify are shared; the containers they modify are copied.
+        """
+        other = copy.copy(self)
+        other.names = list(self.names)
+        other.rows = dict(self.rows)
+        other.alive = self.alive.copy()
+        other.lists = list(self.lists)
+        return other
+
+    def sync(self, index, summary):
+        """Applies an EmbeddingIndex.update() summary incrementally."""
+        changed = summary["added"] + summary["changed"]
+        rows = {name: i for i, name in enumerate(index.names)}
+        present = [name for name in changed if name in rows]
+        #  A changed photo that could not be re-embedded has left the EmbeddingIndex; its old vector goes too
+        self.delete(summary["removed"] + [name for name in changed if name not in rows])
+        if present:
+            self.add(present, index.embeddings[[rows[name] for name in present]])
+        self.unsaved += len(changed) + len(summary["removed"])
+
+    def reconcile(self, index):
+        """Brings a loaded index in line with an EmbeddingIndex whose changes it may have missed.
+
+        Returns the number of faces removed, added or replaced.
+        """
+        rows = {name: i for i, name in enumerate(index.names)}
+        stale = [name for name in self.rows if name not in rows]
+        self.delete(stale)
+
+        update = [name for name in index.names if name not in self.rows]
+        common = [name for name in index.names if name in self.rows]
+        for start in range(0, len(common), CHUNK_ROWS):
+            chunk = common[start:start + CHUNK_ROWS]
+            vectors, norms = normalize_rows(index.embeddings[[rows[name] for name in chunk]])
+            mine = [self.rows[name] for name in chunk]
+            differs = (np.abs(vectors - self.vectors[mine]).max(axis=1) > 1e-6) | ~np.isclose(norms, self.norms[mine])
+            update.extend(name for name, moved in zip(chunk, differs) if moved)
+        if update:
+            self.add(update, index.embeddings[[rows[name] for name in update]])
+
+        self.unsaved += len(stale) + len(update)
+        return len(stale) + len(update)
+
+    def search(self, query, k=5, nprobe=None, names=None):
+        """Returns the top-k candidates, scanning nprobe lists (or everything in exact mode).
+
+        names, if given, limits the search to those gallery photos.
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query_norm = float(np.linalg.norm(query))
+        unit = query / max(query_norm, EPSILON)
+
+        if self.is_exact:
+            rows = np.flatnonzero(self.alive)
+        else:
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            probe = np.argpartition(-(self.centroids @ unit), nprobe - 1)[:nprobe]
+            rows = np.concatenate([self.lists[i] for i in probe]) if nprobe else np.zeros(0, dtype=np.int64)
+        if names is not None:
+            rows = rows[np.isin(rows, subset_rows(self.rows, names))]
+
+        if not len(rows):
+            return []
+        cosine = self.vectors[rows] @ unit
+        distance = l2_from_cosine(cosine, self.norms[rows], query_norm)
+        return rank_top_k(self.names, self.image_folder, rows, cosine, distance, k)
+
+    def save(self, path):
+        """Writes the live rows to a single .npz file (no pickling) without changing the index."""
+        keep = np.flatnonzero(self.alive)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            names=np.array([self.names[i] for i in keep], dtype=str),
+            vectors=self.vectors[keep],
+            norms=self.norms[keep],
+            labels=self.labels[keep],
+            centroids=self.centroids if self.centroids is not None else np.zeros((0, 0), dtype=np.float32),
+            settings=np.array([self.nlist or 0, self.nprobe, self.exact_threshold, self.trained_size]),
+        )
+        os.replace(tmp_path, path)
+        self.unsaved = 0
+        self.saved_at = time.monotonic()
+
+    def save_if_due(self, path, interval=SAVE_INTERVAL):
+        """Saves unsaved changes once the last save is older than interval seconds; returns True if it saved."""
+        if self.unsaved and time.monotonic() - self.saved_at >= interval:
+            self.save(path)
+            return True
+        return False
+
+    @classmethod
+    def load(cls, path, image_folder=""):
+        with np.load(path, allow_pickle=False) as data:
+            nlist, nprobe, exact_threshold, trained_size = (int(v) for v in data["settings"])
+            index = cls(image_folder, nlist or None, nprobe, exact_threshold)
+            index.names = data["names"].tolist()
+            index.rows = {name: i for i, name in enumerate(index.names)}
+            index.vectors, index.norms, index.labels = data["vectors"], data["norms"], data["labels"]
+            index.centroids = data["centroids"] if data["centroids"].size else None
+        index.alive = np.ones(len(index.names), dtype=bool)
+        index.trained_size = trained_size
+        index._rebuild_lists()
+        return index
+
+def ann_path(index):
+    return os.path.join(index.index_dir, f"{index.model_name}_ivf.npz")
+
+def engine_for(index, previous=None, summary=None, exact_threshold=EXACT_THRESHOLD, nprobe=NPROBE):
+    """Returns the search engine for an EmbeddingIndex: exact for small galleries, IVF otherwise.
+
+    An existing IVF engine is copied and the copy updated from the update summary (searches
+    may still be running on the old one), and saved at
+    most every SAVE_INTERVAL seconds; one saved on disk is reconciled with the indexed
+    photos and reused. Either is retrained once it has outgrown its training set.
+    """
+    if len(index) < exact_threshold:
+        return SearchEngine.from_index(index)
+
+    path = ann_path(index)
+    if isinstance(previous, IVFIndex) and summary is not None:
+        ann = previous
+        if any(summary.values()):
+            ann = previous.copy()
+            ann.sync(index, summary)
+        if not ann.needs_retrain:
+            ann.save_if_due(path)
+            return ann
+    elif os.path.exists(path):
+        try:
+            ann = IVFIndex.load(path, index.image_folder)
+            ann.nprobe = nprobe
+            ann.reconcile(index)
+            if not ann.needs_retrain:
+                if ann.unsaved:
+                    ann.save(path)
+                return ann
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable ANN index '{path}': {e}")
+
+    print(f"Training ANN index for {len(index)} faces...")
+    ann = IVFIndex(index.image_folder, nprobe=nprobe, exact_threshold=exact_threshold).build(index.names, index.embeddings)
+    ann.save(path)
+    return ann
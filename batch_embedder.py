@@ -0,0 +1,123 @@
+import os
+import sys
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from deepface import DeepFace
+from deepface.modules import preprocessing
+from face_cache import face_cache
+
+MODEL_NAME = "Facenet"
+DETECTOR_BACKEND = "opencv"  # DeepFace.represent's default detector
+BATCH_SIZE = 32
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+#  Models whose client.forward is a plain call of a Keras model, so whole batches can go through it at once
+BATCHED_MODELS = {"Facenet", "Facenet512", "ArcFace", "OpenFace", "DeepFace", "DeepID", "GhostFaceNet", "VGG-Face"}
+L2_NORMALIZED = {"VGG-Face"}  # Clients whose forward() L2-normalizes the model output
+
+class BatchEmbedder:
+    """Gallery embeddings from batched forward passes through the DeepFace model.
+
+    Each image goes through the same steps as DeepFace.represent(enforce_detection=False):
+    detection and alignment, BGR order, padded resize and "base" normalization. Those run
+    on a thread pool, and the preprocessed faces go through the model a batch at a time.
+    Aligned faces of image files come from the shared face cache, so each photo is
+    detected once no matter how many models embed it.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND, batch_size=BATCH_SIZE, max_workers=MAX_WORKERS, cache=face_cache):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.batch_size = batch_size
+        self.cache = cache
+        self.client = DeepFace.build_model(model_name)
+        self.target_size = self.client.input_shape
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embed-preprocess")
+
+    def detect(self, image):
+        """The first aligned face (or the whole image if none is found) as a float RGB array, or None."""
+        faces = DeepFace.extract_faces(
+            image, detector_backend=self.detector_backend, enforce_detection=False, align=True
+        )
+        return faces[0]["face"] if faces else None
+
+    def preprocess(self, image, use_cache=True):
+        """The model input for an image path or BGR array; use_cache=False detects a path afresh."""
+        if isinstance(image, str) and use_cache and self.cache is not None:
+            face = self.cache.face(image, self.detector_backend, self.detect)
+        else:
+            face = self.detect(image)
+        if face is None:
+            return None
+        face = face[:, :, ::-1]  # RGB -> BGR, as represent does
+        face = preprocessing.resize_image(img=face, target_size=(self.target_size[1], self.target_size[0]))
+        return preprocessing.normalize_input(img=face, normalization="base")
+
+    def _preprocess_safe(self, image):
+        try:
+            return self.preprocess(image)
+        except Exception as e:
+            name = os.path.basename(image) if isinstance(image, str) else "image"
+            print(f"Skipping {name} due to error: {e}")
+            return None
+
+    def forward(self, batch):
+        """Embeddings for a stacked (n, height, width, 3) batch of preprocessed faces, as client.forward gives them."""
+        if self.model_name not in BATCHED_MODELS:
+            #  Dlib, SFace and other non-Keras clients: one face at a time through DeepFace's own forward
+            return np.stack([np.asarray(self.client.forward(face[None]), dtype=np.float32).reshape(-1) for face in batch])
+
+        embeddings = np.asarray(self.client.model(batch, training=False), dtype=np.float32)
+        if self.model_name in L2_NORMALIZED:
+            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+    def embed_many(self, images):
+        """Embeddings for image paths or BGR arrays, in order; entries are None where an image failed."""
+        images = list(images)
+        embeddings = [None] * len(images)
+        for start in range(0, len(images), self.batch_size):
+            chunk = images[start:start + self.batch_size]
+            faces = list(self.executor.map(self._preprocess_safe, chunk))
+            rows = [i for i, face in enumerate(faces) if face is not None]
+            if not rows:
+                continue
+            batch = np.concatenate([faces[i] for i in rows]).astype(np.float32)
+            try:
+                vectors = self.forward(batch)
+            except Exception as e:
+                print(f"Skipping {len(rows)} images, {self.model_name} forward pass failed: {e}")
+                continue
+            for i, embedding in zip(rows, vectors):
+                embeddings[start + i] = embedding
+        return embeddings
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+def get_embedder(model_name=MODEL_NAME):
+    """Returns the shared BatchEmbedder for a model, creating it on first use."""
+    with _embedders_lock:
+        if model_name not in _embedders:
+            _embedders[model_name] = BatchEmbedder(model_name)
+        return _embedders[model_name]
+
+def check_parity(image_paths, model_name=MODEL_NAME):
+    """Largest absolute difference between batched embeddings and DeepFace.represent on the same images.
+
+    The face cache is bypassed, since its 8-bit crops differ slightly from a fresh detection.
+    """
+    batched = BatchEmbedder(model_name, cache=None).embed_many(image_paths)
+    worst = 0.0
+    for path, embedding in zip(image_paths, batched):
+        reference = DeepFace.represent(path, model_name=model_name, enforce_detection=False)[0]["embedding"]
+        worst = max(worst, float(np.abs(np.asarray(reference, dtype=np.float32) - embedding).max()))
+    return worst
+
+if __name__ == "__main__":
+    from embedding_index import IMAGE_DIR, IMAGE_EXTENSIONS
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else IMAGE_DIR
+    model_name = sys.argv[2] if len(sys.argv) > 2 else MODEL_NAME
+    paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.lower().endswith(IMAGE_EXTENSIONS)][:16]
+    print(f"Max |batched - represent| for {model_name} over {len(paths)} images: {check_parity(paths, model_name):.2e}")
@@ -0,0 +1,138 @@
+import os
+import csv
+import json
+import glob
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import run_model
+import compare
+from embedding_index import IMAGE_EXTENSIONS
+from landmarks import query_points
+from records import get_store
+
+CSV_FIELDS = ["sketch", "rank", "photo", "cosine", "distance", "score", "name", "crime", "error"]
+
+def find_sketches(patterns):
+    """Expands directories and glob patterns into a sorted, de-duplicated list of image paths."""
+    sketches = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = [os.path.join(pattern, name) for name in sorted(os.listdir(pattern))]
+        else:
+            paths = sorted(glob.glob(pattern))
+        sketches.extend(path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS))
+    return list(dict.fromkeys(sketches))
+
+def match_sketch(sketch_path, top_k=5):
+    """Reconstructs and matches one sketch in memory; returns a JSON-friendly dict."""
+    try:
+        ssim_score, img = run_model.reconstruct_batch([run_model.load_sketch(sketch_path)])[0]
+        matcher = compare.get_matcher()
+        bgr = compare.to_bgr_uint8(img)
+        query = matcher.embed(bgr)
+        if query is None:
+            return {"sketch": sketch_path, "matches": [], "error": "No valid embedding found."}
+        points = query_points(sketch_path, bgr) if compare.PREFILTER else None
+        result = matcher.match_embedding(query, top_k, refresh=False, query_path=sketch_path, landmarks=points, image=bgr)
+    except Exception as e:
+        return {"sketch": sketch_path, "matches": [], "error": str(e)}
+
+    return {"sketch": sketch_path, "ssim": ssim_score, "matches": result.to_dict()["candidates"], "error": result.error}
+
+class ResultWriter:
+    """Appends results to a CSV (one row per match) or JSONL (one line per sketch) file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.format = "csv" if path.lower().endswith(".csv") else "jsonl"
+
+    def completed(self):
+        """Sketches that already have a successful result in the output file."""
+        if not os.path.exists(self.path):
+            return set()
+
+        done = set()
+        with open(self.path, "r", newline="") as file:
+            if self.format == "csv":
+                for row in csv.DictReader(file):
+                    if not row.get("error"):
+                        done.add(row["sketch"])
+            else:
+                for line in file:
+                    try:
+                        result = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Partial last line from an interrupted run
+                    if not result.get("error"):
+                        done.add(result["sketch"])
+        return done
+
+    def __enter__(self):
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.file = open(self.path, "a", newline="")
+        if self.format == "csv":
+            self.csv = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            if is_new:
+                self.csv.writeheader()
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+    def write(self, result):
+        if self.format == "csv":
+            rows = [
+                {"sketch": result["sketch"], "rank": rank, "photo": match["name"], "cosine": match["cosine"],
+                 "distance": match["distance"], "score": match["score"], "name": match.get("record_name", ""),
+                 "crime": match.get("record_crime", ""), "error": ""}
+                for rank, match in enumerate(result["matches"], start=1)
+            ] or [{"sketch": result["sketch"], "error": result.get("error") or "No matches"}]
+            self.csv.writerows(rows)
+        else:
+            self.file.write(json.dumps(result) + "\n")
+        self.file.flush()
+
+def run_batch(patterns, output, top_k=5, workers=1, use_processes=False):
+    """Matches every sketch not already in output, streaming results as they finish."""
+    writer = ResultWriter(output)
+    sketches = find_sketches(patterns)
+    done = writer.completed()
+    pending = [sketch for sketch in sketches if sketch not in done]
+    print(f"{len(sketches)} sketches found, {len(sketches) - len(pending)} already done, {len(pending)} to process.")
+    if not pending:
+        return
+
+    #  Bring the gallery index up to date once instead of in every job
+    compare.get_matcher().refresh()
+    records = get_store()
+
+    if use_processes:
+        #  TensorFlow is not fork-safe, so worker processes start fresh and load their own models
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    else:
+        executor = ThreadPoolExecutor(workers)
+
+    with executor, writer:
+        futures = [executor.submit(match_sketch, sketch, top_k) for sketch in pending]
+        for count, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            for match in result["matches"]:
+                record = records.find_by_photo(match["name"]) or {}
+                match["record_name"] = record.get("name", "")
+                match["record_crime"] = record.get("crime", "")
+            writer.write(result)
+
+            best = result["matches"][0]["name"] if result["matches"] else result.get("error")
+            print(f"[{count}/{len(pending)}] {result['sketch']} -> {best}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruct and match a directory or glob of sketches.")
+    parser.add_argument("inputs", nargs="+", help="Sketch directories or glob patterns")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="Output .csv or .jsonl file (resumed if it exists)")
+    parser.add_argument("-k", "--top-k", type=int, default=5)
+    parser.add_argument("-w", "--workers", type=int, default=1)
+    parser.add_argument("--processes", action="store_true", help="Use worker processes instead of threads")
+    args = parser.parse_args()
+
+    run_batch(args.inputs, args.output, args.top_k, args.workers, args.processes)
@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import time
+import platform
+import argparse
+import numpy as np
+import run_model
+import compare
+from batch_match import find_sketches
+from landmarks import query_points
+
+SKETCH_DIR = "Kaggle/sketches"
+REPORT_FILE = "benchmark_report.json"
+RECALL_AT = (1, 5, 10)
+
+#  CUHK sketches of the "F2"/"M2" sets correspond to the "f"/"m" photos
+PREFIX_ALIASES = {"f2": "f", "m2": "m"}
+
+def subject_id(filename):
+    """Shared subject ID of a CUHK photo or sketch filename, e.g. 'F2-005-01-sz1.jpg' -> 'f-005'."""
+    found = re.match(r"([a-zA-Z]+\d?)-(\d+)", os.path.basename(filename))
+    if not found:
+        return None
+    prefix = found.group(1).lower()
+    return f"{PREFIX_ALIASES.get(prefix, prefix)}-{found.group(2)}"
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it cannot be measured."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #  Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+def summarize(seconds):
+    """Mean, median, p95 and total of a list of durations, in milliseconds."""
+    values = np.asarray(seconds) * 1000
+    if not values.size:
+        return {}
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "total_ms": float(values.sum()),
+    }
+
+def run_benchmark(sketch_dir=SKETCH_DIR, limit=None, num_samples=run_model.NUM_SAMPLES, output=REPORT_FILE, detect_landmarks=False):
+    """Runs every sketch through reconstruction and matching and writes recall and timing to output.
+
+    detect_landmarks ignores the sketches' point files, measuring the prefilter as it works on new sketches.
+    """
+    sketches = find_sketches([sketch_dir])[:limit]
+    max_k = max(RECALL_AT)
+    matcher = compare.get_matcher()
+
+    start = time.perf_counter()
+    matcher.refresh()
+    index_seconds = time.perf_counter() - start
+
+    stages = {"load": [], "reconstruct": [], "embed": [], "search": [], "total": []}
+    hits = {k: 0 for k in RECALL_AT}
+    per_sketch = []
+    evaluated = 0
+    wall_start = time.perf_counter()
+
+    for count, sketch in enumerate(sketches, start=1):
+        truth = subject_id(sketch)
+
+        t0 = time.perf_counter()
+        img_array = run_model.load_sketch(sketch)
+        t1 = time.perf_counter()
+        _, img = run_model.reconstruct_batch([img_array], num_samples)[0]
+        t2 = time.perf_counter()
+        bgr = compare.to_bgr_uint8(img)
+        query = matcher.embed(bgr)
+        t3 = time.perf_counter()
+        points = query_points(sketch, bgr, use_files=not detect_landmarks) if compare.PREFILTER else None
+        result = matcher.match_embedding(query, max_k, refresh=False, landmarks=points, image=bgr) if query is not None else None
+        t4 = time.perf_counter()
+
+        timings = {"load": t1 - t0, "reconstruct": t2 - t1, "embed": t3 - t2, "search": t4 - t3, "total": t4 - t0}
+        for stage, seconds in timings.items():
+            stages[stage].append(seconds)
+
+        ranked = [candidate.name for candidate in result.candidates] if result else []
+        ranked_ids = [subject_id(name) for name in ranked]
+        rank = ranked_ids.index(truth) + 1 if truth in ranked_ids else None
+        if truth is not None:
+            evaluated += 1
+            for k in RECALL_AT:
+                hits[k] += rank is not None and rank <= k
+
+        per_sketch.append({"sketch": sketch, "truth": truth, "rank": rank, "top": ranked[:5],
+                           "ms": {stage: seconds * 1000 for stage, seconds in timings.items()}})
+        print(f"[{count}/{len(sketches)}] {os.path.basename(sketch)}: rank {rank}, {timings['total']:.2f}s")
+
+    wall_seconds = time.perf_counter() - wall_start
+    report = {
+        "config": {
+            "sketch_dir": sketch_dir,
+            "gallery": matcher.image_folder,
+            "gallery_size": len(matcher.index),
+            "face_model": matcher.model_name,
+            "landmark_prefilter": compare.PREFILTER,
+            "detected_landmarks": detect_landmarks,
+            "rerank_models": list(compare.RERANK_MODELS),
+            "inference_backend": run_model.vae_engine.name,
+            "num_samples": num_samples,
+            "platform": platform.platform(),
+        },
+        "sketches": len(sketches),
+        "evaluated": evaluated,
+        "recall": {f"@{k}": hits[k] / evaluated if evaluated else None for k in RECALL_AT},
+        "index_update_s": index_seconds,
+        "stages": {stage: summarize(seconds) for stage, seconds in stages.items()},
+        "wall_s": wall_seconds,
+        "throughput_per_s": len(sketches) / wall_seconds if wall_seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "results": per_sketch,
+    }
+
+    with open(output, "w") as file:
+        json.dump(report, file, indent=4)
+
+    print(f"Recall: {report['recall']}")
+    print(f"Throughput: {report['throughput_per_s']:.3f} sketches/s, peak RSS: {report['peak_rss_mb']} MB")
+    print(f"Report written to '{output}'.")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure retrieval recall and per-stage latency on the CUHK sketches.")
+    parser.add_argument("--sketches", default=SKETCH_DIR)
+    parser.add_argument("--limit", type=int, default=None, help="Only run the first N sketches")
+    parser.add_argument("--samples", type=int, default=run_model.NUM_SAMPLES, help="VAE samples per sketch")
+    parser.add_argument("-o", "--output", default=REPORT_FILE)
+    parser.add_argument("--detect-landmarks", action="store_true", help="Ignore sketch point files and detect landmarks on the reconstruction")
+    args = parser.parse_args()
+
+    run_benchmark(args.sketches, args.limit, args.samples, args.output, args.detect_landmarks)
@@ -0,0 +1,82 @@
+import threading
+import numpy as np
+from embedding_index import EmbeddingIndex, INDEX_DIR
+from batch_embedder import get_embedder
+from search import EPSILON
+from metrics import span
+
+SHORTLIST_SIZE = 50  # First-stage candidates passed on to the heavier models
+FIRST_STAGE_WEIGHT = 1.0  # Weight of the first-stage cosine in the fused score; each reranker counts 1.0
+
+def zscores(values):
+    """Standardizes scores within the shortlist so models with different cosine ranges can be averaged."""
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    if valid.sum() < 2:
+        return np.where(valid, 0.0, np.nan)
+    spread = values[valid].std()
+    return (values - values[valid].mean()) / max(spread, EPSILON)
+
+def fuse(stage_scores, weights):
+    """Weighted mean of the z-scored stage scores per candidate, skipping stages with no score for it."""
+    stacked = np.stack([zscores(scores) for scores in stage_scores])
+    weights = np.asarray(weights, dtype=np.float64)[:, None] * ~np.isnan(stacked)
+    total = np.nansum(np.nan_to_num(stacked) * weights, axis=0)
+    return total / np.maximum(weights.sum(axis=0), EPSILON)
+
+class Reranker:
+    """One heavier DeepFace model that scores a shortlist of gallery photos.
+
+    Gallery embeddings are cached in the model's own index in index/, filled in only for the
+    photos that have made a shortlist, so the model never has to embed the whole gallery.
+    """
+
+    def __init__(self, image_folder, model_name, index_dir=INDEX_DIR):
+        self.model_name = model_name
+        self.index = EmbeddingIndex(image_folder, model_name, index_dir)
+        self.lock = threading.Lock()
+        self.embedder = get_embedder(model_name)
+
+    def scores(self, image, names):
+        """Cosine similarity of the query image to each named photo, NaN where either has no embedding."""
+        #  Same preprocessing as Matcher.embed, so the query and gallery embeddings agree
+        face = self.embedder.preprocess(image, use_cache=False)
+        if face is None:
+            return np.full(len(names), np.nan)
+        query = self.embedder.forward(face)[0]
+
+        with self.lock:
+            self.index.ensure(names)
+            rows = {name: i for i, name in enumerate(self.index.names)}
+            embeddings = self.index.embeddings
+
+        query = query / max(float(np.linalg.norm(query)), EPSILON)
+        scores = np.full(len(names), np.nan)
+        for i, name in enumerate(names):
+            if name in rows:
+                row = embeddings[rows[name]]
+                scores[i] = float(row @ query) / max(float(np.linalg.norm(row)), EPSILON)
+        return scores
+
+class Cascade:
+    """Second stage of retrieval: re-orders a first-stage shortlist by the fused scores of heavier models."""
+
+    def __init__(self, image_folder, model_names, shortlist_size=SHORTLIST_SIZE, first_stage_weight=FIRST_STAGE_WEIGHT):
+        self.shortlist_size = shortlist_size
+        self.first_stage_weight = first_stage_weight
+        self.rerankers = [Reranker(image_folder, model_name) for model_name in model_names]
+
+    def rerank(self, image, candidates):
+        """Returns the candidates re-ordered best first; each keeps its first-stage cosine and distance."""
+        if len(candidates) < 2:
+            return candidates
+
+        names = [candidate.name for candidate in candidates]
+        stage_scores = [np.array([candidate.cosine for candidate in candidates])]
+        for reranker in self.rerankers:
+            with span("rerank_model", model=reranker.model_name):
+                stage_scores.append(reranker.scores(image, names))
+
+        fused = fuse(stage_scores, [self.first_stage_weight] + [1.0] * len(self.rerankers))
+        order = np.argsort(-fused, kind="stable")
+        return [candidates[i] for i in order]
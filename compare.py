@@ -1,89 +1,227 @@
-import os
+import sys
+import threading
 import numpy as np
 from deepface import DeepFace
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy.spatial.distance import euclidean
+from embedding_index import EmbeddingIndex
+from ann_index import engine_for
+from embedding_store import open_store
+from landmarks import LandmarkIndex
+from metrics import span, traced
+from batch_embedder import get_embedder
+from cascade import Cascade
 
 # Choose the best-performing model
 MODEL_NAME = "Facenet"  # Try: "VGG-Face", "ArcFace", "Dlib", "DeepID", "Facenet"
+IMAGE_FOLDER = "Kaggle/photos"
+MAX_EUCLIDEAN = 10  # **You can adjust this based on your dataset**
+PREFILTER = False  # Narrow the gallery by facial landmark geometry before comparing embeddings (recall with detected landmarks not yet measured)
+STORE_ENCODING = None  # "float16", "int8" or "pq" to search a compact memory-mapped copy of the gallery
+RERANK_MODELS = ()  # e.g. ("ArcFace", "VGG-Face"): re-score the top matches with heavier models and fuse the scores
+
+def to_bgr_uint8(img):
+    """Converts a float RGB image in [0, 1] into the uint8 BGR layout DeepFace expects."""
+    return np.ascontiguousarray((np.clip(img, 0, 1) * 255).round().astype(np.uint8)[..., ::-1])
+
+def similarity_score(cosine_sim, euclidean_dist, max_euclidean=MAX_EUCLIDEAN):
+    """Computes the custom 0-100 style match score from cosine similarity and L2 distance."""
+    euclidean_scaled = (euclidean_dist / max_euclidean) * 100  # Normalize to 0-100
+    return (cosine_sim * 100) - euclidean_scaled
+
+class MatchResult:
+    """Ranked gallery candidates for one query image."""
+
+    def __init__(self, query_path, candidates, model_name=MODEL_NAME, error=None):
+        self.query_path = query_path
+        self.candidates = candidates
+        self.model_name = model_name
+        self.error = error
+
+    @property
+    def best(self):
+        """The top-ranked candidate, or None if nothing matched."""
+        return self.candidates[0] if self.candidates else None
+
+    @property
+    def score(self):
+        """Custom similarity score of the best candidate."""
+        best = self.best
+        return similarity_score(best.cosine, best.distance) if best else 0.0
+
+    def __bool__(self):
+        return bool(self.candidates)
+
+    def to_dict(self):
+        """JSON-friendly form of the result."""
+        return {
+            "query": self.query_path,
+            "model": self.model_name,
+            "score": self.score,
+            "error": self.error,
+            "candidates": [
+                dict(candidate._asdict(), score=similarity_score(candidate.cosine, candidate.distance))
+                for candidate in self.candidates
+            ],
+        }
+
+class Matcher:
+    """Keeps the DeepFace model and gallery index resident so repeated queries pay no startup cost."""
+
+    def __init__(self, image_folder=IMAGE_FOLDER, model_name=MODEL_NAME):
+        self.image_folder = image_folder
+        self.model_name = model_name
+        #  The compact store keeps its own mapped copy, so the float32 matrix is only mapped, not loaded
+        self.index = EmbeddingIndex(image_folder, model_name, mmap=bool(STORE_ENCODING))
+        self.engine = None
+        self.landmarks = LandmarkIndex(image_folder) if PREFILTER else None
+        self.lock = threading.Lock()
+
+        print(f"Using {model_name} model for comparison...")
+
+        #  Load the DeepFace model once; DeepFace reuses it for every later call
+        DeepFace.build_model(model_name)
+        self.cascade = Cascade(image_folder, RERANK_MODELS) if RERANK_MODELS else None
+        if self.cascade:
+            print(f"Re-ranking the top {self.cascade.shortlist_size} with {', '.join(RERANK_MODELS)}...")
+
+    def refresh(self):
+        """Embeds new or changed gallery photos and rebuilds the search engine if needed."""
+        with self.lock, span("index_refresh"):
+            summary = self.index.update()
+            if self.landmarks is not None:
+                with span("landmark_refresh"):
+                    self.landmarks.update()
+            if self.engine is None or any(summary.values()):
+                self._update_engine(summary)
+            return self.engine
+
+    def _update_engine(self, summary):
+        if STORE_ENCODING:
+            self.engine = open_store(self.index, STORE_ENCODING, previous=self.engine, summary=summary)
+        else:
+            self.engine = engine_for(self.index, self.engine, summary)
+
+    def add_photo(self, name):
+        """Indexes one new gallery photo and makes it searchable without re-scanning the gallery."""
+        with self.lock, span("index_photo"):
+            summary = self.index.add_photo(name)
+            if self.landmarks is not None:
+                self.landmarks.add_photo(name)
+            #  Without an engine yet, the first refresh builds one that already includes the photo
+            if self.engine is not None and any(summary.values()):
+                self._update_engine(summary)
+            return summary
+
+    def embed(self, image_path):
+        """Computes the query embedding for an image path or a BGR image array.
+
+        Face detection and the embedding model are timed as separate "detect" and "embed" spans.
+        """
+        embedder = get_embedder(self.model_name)
+        with span("detect"):
+            face = embedder.preprocess(image_path, use_cache=False)  # Queries are not gallery photos
+        if face is None:
+            return None
+        with span("embed"):
+            return embedder.forward(face)[0]
+
+    def embed_batch(self, images):
+        """Computes query embeddings for several images in one forward pass; entries are None where embedding failed."""
+        return get_embedder(self.model_name).embed_many(images)
+
+    @traced("match")
+    def match(self, image_path, top_k=5, refresh=True, progress=None, landmarks=None, query_path=None):
+        """Matches one image (a path or a BGR array) against the gallery and returns a MatchResult.
+
+        progress, if given, is called with the name of each stage as it starts; landmarks, if
+        given, are the query's facial points used to prefilter the gallery. query_path names
+        the query in the result when the image is passed as an array.
+        """
+        if query_path is None and isinstance(image_path, str):
+            query_path = image_path
+        if progress:
+            progress("embedding")
+        print("Computing embedding for the reconstructed image...")
+        try:
+            query = self.embed(image_path)
+        except Exception as e:
+            print(f"Error computing embedding for reconstructed image: {e}")
+            return MatchResult(query_path, [], self.model_name, error=str(e))
+
+        if query is None:
+            print("Error: No valid embedding found for the generated image.")
+            return MatchResult(query_path, [], self.model_name, error="No valid embedding found.")
+
+        return self.match_embedding(query, top_k, refresh, progress, query_path=query_path, landmarks=landmarks, image=image_path)
 
-def compare(generated_image_path, image_folder="Kaggle/photos"):
-    """Finds the most similar image to the reconstructed image."""
-    
-    print(f"Using {MODEL_NAME} model for comparison...")
+    def match_embedding(self, query, top_k=5, refresh=True, progress=None, query_path=None, landmarks=None, image=None):
+        """Searches the gallery with an already computed query embedding.
 
-    #  Load the DeepFace model once to avoid redundant calls
+        image, the query image itself, lets the cascade re-rank the shortlist with its heavier models.
+        """
+        try:
+            engine = self.refresh() if refresh or self.engine is None else self.engine
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            return MatchResult(query_path, [], self.model_name, error=str(e))
+
+        #  Cheap geometric first pass: only faces shaped like the query go on to the embedding comparison
+        names = None
+        if landmarks is not None and self.landmarks is not None:
+            with span("prefilter"):
+                names = self.landmarks.shortlist(landmarks)
+            print(f"Landmark prefilter kept {len(names)} of {len(self.landmarks.names)} photos.")
+
+        #  Score the (remaining) gallery at once and keep the top-k
+        if progress:
+            progress("searching")
+        rerank = self.cascade is not None and image is not None
+        with span("search"):
+            candidates = engine.search(query, max(top_k, self.cascade.shortlist_size) if rerank else top_k, names=names)
+        if rerank and candidates:
+            if progress:
+                progress("re-ranking")
+            with span("rerank"):
+                candidates = self.cascade.rerank(image, candidates)[:top_k]
+        if not candidates:
+            print("No valid images found for comparison.")
+            return MatchResult(query_path, [], self.model_name, error="No valid images found.")
+
+        best = candidates[0]
+        print(f"Most similar image: {best.name}")
+        print(f"Cosine Similarity: {best.cosine:.4f}, Euclidean Distance: {best.distance:.4f}")
+        return MatchResult(query_path, candidates, self.model_name)
+
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+def get_matcher(image_folder=IMAGE_FOLDER, model_name=MODEL_NAME):
+    """Returns the shared Matcher for a gallery/model pair, creating it on first use."""
+    key = (image_folder, model_name)
+    with _matchers_lock:
+        if key not in _matchers:
+            _matchers[key] = Matcher(image_folder, model_name)
+        return _matchers[key]
+
+def index_photo(name, image_folder=IMAGE_FOLDER):
+    """Background job: embeds a photo just added to the gallery into the shared matcher's index."""
     try:
-        model = DeepFace.build_model(MODEL_NAME)
+        return get_matcher(image_folder, MODEL_NAME).add_photo(name)
     except Exception as e:
-        print(f"Error loading {MODEL_NAME} model: {e}")
+        print(f"Error indexing {name}: {e}")
         return None
 
-    #  Compute the embedding for the generated image
-    print("Computing embedding for the reconstructed image...")
+def compare(generated_image_path, image_folder=IMAGE_FOLDER, top_k=5):
+    """Finds the gallery images most similar to the reconstructed image, best match first."""
     try:
-        generated_embedding = DeepFace.represent(
-            generated_image_path, model_name=MODEL_NAME, enforce_detection=False
-        )
-
-        if not generated_embedding or not generated_embedding[0].get('embedding'):
-            print("Error: No valid embedding found for the generated image.")
-            return None
-
-        generated_embedding = np.array(generated_embedding[0]['embedding'])
-
+        matcher = get_matcher(image_folder, MODEL_NAME)
     except Exception as e:
-        print(f"Error computing embedding for reconstructed image: {e}")
-        return None
-
-    similarity_scores = []
-
-    #  Ensure image folder exists
-    if not os.path.exists(image_folder):
-        print(f"Error: Image folder '{image_folder}' not found.")
-        return None
-
-    #  Loop through all images in the dataset folder
-    for image_name in os.listdir(image_folder):
-        image_path = os.path.join(image_folder, image_name)
-
-        try:
-            #  Compute embedding for dataset image
-            face_embedding = DeepFace.represent(
-                image_path, model_name=MODEL_NAME, enforce_detection=False
-            )
-
-            if not face_embedding or not face_embedding[0].get('embedding'):
-                print(f"Skipping {image_name} (No valid face detected)")
-                continue
-
-            face_embedding = np.array(face_embedding[0]['embedding'])
-
-            #  Compute both cosine similarity and Euclidean distance
-            cosine_sim = cosine_similarity([generated_embedding], [face_embedding])[0][0]
-            l2_distance = euclidean(generated_embedding, face_embedding)
-
-            #  Store results (higher cosine similarity is better, lower L2 distance is better)
-            similarity_scores.append((image_name, cosine_sim, l2_distance))
-
-        except Exception as e:
-            print(f"Skipping {image_name} due to error: {e}")
-
-    if not similarity_scores:
-        print("No valid images found for comparison.")
+        print(f"Error loading {MODEL_NAME} model: {e}")
         return None
 
-    #  Sort by cosine similarity (descending) and L2 distance (ascending)
-    similarity_scores.sort(key=lambda x: (-x[1], x[2]))
-
-    #  Get the most similar image
-    most_similar_image_name, highest_score, lowest_distance = similarity_scores[0]
-    most_similar_image_path = os.path.join(image_folder, most_similar_image_name)
-
-    print(f"Most similar image: {most_similar_image_name}")
-    print(f"Cosine Similarity: {highest_score:.4f}, Euclidean Distance: {lowest_distance:.4f}")
-
-    return most_similar_image_path
+    result = matcher.match(generated_image_path, top_k)
+    return result.candidates or None
 
-#  Corrected function call with proper path separator
-compare("temp/reconstructed_image.png")
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python compare.py <reconstructed image>")
+    compare(sys.argv[1])
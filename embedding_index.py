@@ -0,0 +1,262 @@
+import os
+import json
+import hashlib
+import numpy as np
+from batch_embedder import get_embedder
+
+INDEX_DIR = "index"
+IMAGE_DIR = "Kaggle/photos"
+MODEL_NAME = "Facenet"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def file_hash(path, chunk_size=1 << 20):
+    """Returns the SHA-1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def scan_images(image_folder):
+    """Lists gallery images with their size and modification time."""
+    files = {}
+    for image_name in sorted(os.listdir(image_folder)):
+        if not image_name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        stat = os.stat(os.path.join(image_folder, image_name))
+        files[image_name] = {"size": stat.st_size, "mtime": stat.st_mtime}
+    return files
+
+class EmbeddingIndex:
+    """On-disk gallery embeddings: an embedding matrix plus a manifest keyed by filename."""
+
+    def __init__(self, image_folder=IMAGE_DIR, model_name=MODEL_NAME, index_dir=INDEX_DIR, mmap=False):
+        self.image_folder = image_folder
+        self.model_name = model_name
+        self.index_dir = index_dir
+        self.mmap = mmap  # Map the matrix read-only instead of loading it, for searchers that keep their own copy
+        self.names = []
+        self.entries = {}  # name -> {"size", "mtime", "sha1"}
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+
+    @property
+    def matrix_path(self):
+        return os.path.join(self.index_dir, f"{self.model_name}_embeddings.npy")
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.index_dir, f"{self.model_name}_manifest.json")
+
+    def __len__(self):
+        return len(self.names)
+
+    def load(self):
+        """Loads the matrix and manifest from disk; returns False if there is no usable index."""
+        if not (os.path.exists(self.matrix_path) and os.path.exists(self.manifest_path)):
+            return False
+
+        try:
+            with open(self.manifest_path, "r") as file:
+                manifest = json.load(file)
+            embeddings = np.load(self.matrix_path, mmap_mode="r" if self.mmap else None)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable index in '{self.index_dir}': {e}")
+            return False
+
+        names = [entry["name"] for entry in manifest.get("entries", [])]
+        if manifest.get("model") != self.model_name or len(names) != len(embeddings):
+            print(f"Index in '{self.index_dir}' does not match {self.model_name}, rebuilding.")
+            return False
+
+        self.names = names
+        self.entries = {entry["name"]: entry for entry in manifest["entries"]}
+        self.embeddings = embeddings
+        return True
+
+    def save(self):
+        """Writes the matrix and manifest atomically so a crash never leaves them out of sync."""
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        manifest = {
+            "model": self.model_name,
+            "image_folder": self.image_folder,
+            "entries": [dict(self.entries[name], name=name) for name in self.names],
+        }
+
+        tmp_matrix = self.matrix_path + ".tmp.npy"
+        tmp_manifest = self.manifest_path + ".tmp"
+        np.save(tmp_matrix, self.embeddings)
+        with open(tmp_manifest, "w") as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(tmp_matrix, self.matrix_path)
+        os.replace(tmp_manifest, self.manifest_path)
+        if self.mmap and len(self.names):
+            self.embeddings = np.load(self.matrix_path, mmap_mode="r")  # Drop the in-memory copy again
+
+    def _scan(self):
+        return scan_images(self.image_folder)
+
+    def update(self):
+        """Re-embeds only photos that were added or changed and drops removed ones.
+
+        Returns a dict with the added, changed and removed filenames.
+        """
+        if not os.path.exists(self.image_folder):
+            raise FileNotFoundError(f"Image folder '{self.image_folder}' not found.")
+
+        if not self.names:
+            self.load()
+
+        current = self._scan()
+        rows = {name: i for i, name in enumerate(self.names)}
+        kept_names, kept_rows, new_entries = [], [], {}
+        to_embed = []
+        refreshed = False
+        summary = {"added": [], "changed": [], "removed": []}
+
+        for name, stat in current.items():
+            entry = self.entries.get(name)
+            if entry is None:
+                to_embed.append(name)
+                summary["added"].append(name)
+                continue
+
+            if entry["size"] == stat["size"] and entry["mtime"] == stat["mtime"]:
+                kept_names.append(name)
+                kept_rows.append(rows[name])
+                new_entries[name] = entry
+                continue
+
+            #  Size or mtime moved: only re-embed if the bytes really changed
+            sha1 = file_hash(os.path.join(self.image_folder, name))
+            if sha1 == entry["sha1"]:
+                kept_names.append(name)
+                kept_rows.append(rows[name])
+                new_entries[name] = dict(stat, sha1=sha1)
+                refreshed = True
+            else:
+                to_embed.append(name)
+                summary["changed"].append(name)
+
+        summary["removed"] = [name for name in self.names if name not in current]
+
+        #  Preprocessing runs on a thread pool and the model sees whole batches
+        new_names, new_vectors = [], []
+        paths = [os.path.join(self.image_folder, name) for name in to_embed]
+        embeddings = get_embedder(self.model_name).embed_many(paths) if paths else []
+        for name, image_path, embedding in zip(to_embed, paths, embeddings):
+            if embedding is None:
+                print(f"Skipping {name} (No valid face detected)")
+                continue
+            new_names.append(name)
+            new_vectors.append(embedding)
+            new_entries[name] = dict(current[name], sha1=file_hash(image_path))
+
+        if not (to_embed or summary["removed"] or refreshed):
+            return summary
+
+        parts = []
+        if kept_rows:
+            parts.append(self.embeddings[kept_rows])
+        if new_vectors:
+            parts.append(np.stack(new_vectors))
+        self.embeddings = np.concatenate(parts).astype(np.float32) if parts else np.zeros((0, 0), dtype=np.float32)
+        self.names = kept_names + new_names
+        self.entries = new_entries
+        self.save()
+
+        print(f"Index updated: {len(summary['added'])} added, {len(summary['changed'])} changed, "
+              f"{len(summary['removed'])} removed ({len(self.names)} faces).")
+        return summary
+
+    def add_photo(self, name):
+        """Embeds a single gallery photo and adds or replaces it without scanning the folder.
+
+        Returns an update() style summary; it is empty if the photo is already indexed or has no face.
+        """
+        if not self.names:
+            self.load()
+
+        summary = {"added": [], "changed": [], "removed": []}
+        image_path = os.path.join(self.image_folder, name)
+        stat = os.stat(image_path)
+        entry = self.entries.get(name)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return summary  # A refresh got to it first
+
+        embedding = get_embedder(self.model_name).embed_many([image_path])[0]
+        if embedding is None:
+            print(f"Skipping {name} (No valid face detected)")
+            return summary
+
+        #  Build a new matrix rather than writing in place; search engines may still hold the old one
+        if name in self.entries:
+            embeddings = self.embeddings.copy()
+            embeddings[self.names.index(name)] = embedding
+            summary["changed"].append(name)
+        else:
+            embeddings = np.concatenate([self.embeddings, embedding[None]]) if self.names else embedding[None]
+            self.names = self.names + [name]
+            summary["added"].append(name)
+
+        self.embeddings = embeddings
+        self.entries[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": file_hash(image_path)}
+        self.save()
+        print(f"Indexed {name} ({len(self.names)} faces).")
+        return summary
+
+    def ensure(self, names):
+        """Embeds whichever of the named photos are missing or out of date, without scanning the folder.
+
+        Used by indexes that only ever hold the photos someone asked about; returns the names embedded.
+        """
+        if not self.names:
+            self.load()
+
+        stale = []
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.image_folder, name))
+            except OSError:
+                continue
+            entry = self.entries.get(name)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+                stale.append((name, stat))
+        if not stale:
+            return []
+
+        paths = [os.path.join(self.image_folder, name) for name, _ in stale]
+        embeddings = get_embedder(self.model_name).embed_many(paths)
+
+        #  Build a new matrix rather than writing in place; readers may still hold the old one
+        names, matrix, entries = list(self.names), list(self.embeddings), dict(self.entries)
+        rows = {name: i for i, name in enumerate(names)}
+        embedded = []
+        for (name, stat), image_path, embedding in zip(stale, paths, embeddings):
+            if embedding is None:
+                print(f"Skipping {name} (No valid face detected)")
+                continue
+            if name in rows:
+                matrix[rows[name]] = embedding
+            else:
+                rows[name] = len(names)
+                names.append(name)
+                matrix.append(embedding)
+            entries[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": file_hash(image_path)}
+            embedded.append(name)
+
+        if embedded:
+            self.embeddings = np.stack(matrix).astype(np.float32)
+            self.names = names
+            self.entries = entries
+            self.save()
+        return embedded
+
+def load_index(image_folder=IMAGE_DIR, model_name=MODEL_NAME, index_dir=INDEX_DIR):
+    """Loads the gallery index and brings it up to date with the image folder."""
+    index = EmbeddingIndex(image_folder, model_name, index_dir)
+    index.update()
+    return index
+
+if __name__ == "__main__":
+    load_index()
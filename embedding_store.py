@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import math
+import shutil
+import hashlib
+import numpy as np
+from search import SearchEngine, EPSILON, normalize_rows, l2_from_cosine, rank_top_k, subset_rows
+
+ENCODINGS = ("float16", "int8", "pq")
+PQ_SUBSPACES = 16       # Sub-vectors per embedding (one uint8 code each)
+PQ_CENTROIDS = 256
+PQ_ITERATIONS = 20
+PQ_TRAIN_POINTS = 16384
+PQ_RETRAIN_GROWTH = 2.0  # Retrain the codebooks once the gallery grows this much past the training size
+RERANK_FACTOR = 10      # Shortlist size for the exact re-score, as a multiple of k
+CHUNK_ROWS = 65536      # Codes decoded per block while scoring
+REENCODE_RATIO = 0.05   # Re-encode once this share of the gallery is held outside the codes...
+REENCODE_MIN = 1000     # ...or this many faces, whichever is larger
+
+def fingerprint(names, embeddings):
+    """Content hash of a gallery, used to name (and reuse) its store directory."""
+    digest = hashlib.sha1("\n".join(names).encode("utf-8"))
+    digest.update(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+    return digest.hexdigest()[:16]
+
+def kmeans(vectors, k, iterations=PQ_ITERATIONS, seed=0):
+    """Plain (Euclidean) k-means; returns k centroids, or fewer if there are fewer points."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        distances = (vectors ** 2).sum(1)[:, None] - 2 * vectors @ centroids.T + (centroids ** 2).sum(1)[None, :]
+        labels = np.argmin(distances, axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+
+        #  Keep the old centroid for empty clusters
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+
+    return centroids
+
+def train_pq(vectors, subspaces=PQ_SUBSPACES, centroids=PQ_CENTROIDS, seed=0):
+    """Trains one codebook per sub-vector; returns an array of shape (subspaces, centroids, dim / subspaces)."""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), PQ_TRAIN_POINTS), replace=False)]
+    width = vectors.shape[1] // subspaces
+
+    codebooks = np.zeros((subspaces, centroids, width), dtype=np.float32)
+    for m in range(subspaces):
+        trained = kmeans(sample[:, m * width:(m + 1) * width], centroids, seed=seed + m)
+        codebooks[m, :len(trained)] = trained
+    return codebooks
+
+def encode_pq(vectors, codebooks):
+    """Nearest codeword of every sub-vector, as a uint8 matrix of shape (n, subspaces)."""
+    subspaces, _, width = codebooks.shape
+    codes = np.empty((len(vectors), subspaces), dtype=np.uint8)
+    for m in range(subspaces):
+        part = vectors[:, m * width:(m + 1) * width]
+        book = codebooks[m]
+        for start in range(0, len(vectors), CHUNK_ROWS):
+            block = part[start:start + CHUNK_ROWS]
+            distances = -2 * block @ book.T + (book ** 2).sum(1)[None, :]
+            codes[start:start + CHUNK_ROWS, m] = np.argmin(distances, axis=1)
+    return codes
+
+class EmbeddingStore:
+    """Compact, memory-mapped gallery embeddings in float16, int8 or product-quantized form.
+
+    A store is a directory of plain .npy files (codes, norms, the exact float32 embeddings and
+    the encoding's scale or codebooks) plus names.json and meta.json. Arrays are opened with
+    np.memmap, so every process searching the same store shares one page-cached copy and nothing
+    is loaded up front. Scores are computed directly on the codes; with rerank the shortlist is
+    re-scored from the mapped exact embeddings, touching only its own rows.
+
+    Photos added, changed or removed after encoding are applied without re-encoding: their old
+    rows are masked and their exact embeddings kept in memory beside the codes.
+    """
+
+    def __init__(self, path, image_folder="", rerank=True, mmap=True):
+        self.path = path
+        self.image_folder = image_folder
+
+        with open(os.path.join(path, "meta.json"), "r") as file:
+            self.meta = json.load(file)
+        with open(os.path.join(path, "names.json"), "r") as file:
+            self.names = json.load(file)
+        self.rows = {name: i for i, name in enumerate(self.names)}
+
+        mode = "r" if mmap else None
+        self.encoding = self.meta["encoding"]
+        self.codes = np.load(os.path.join(path, "codes.npy"), mmap_mode=mode)
+        self.norms = np.load(os.path.join(path, "norms.npy"), mmap_mode=mode)
+        self.scale = np.load(os.path.join(path, "scale.npy"), mmap_mode=mode) if self.encoding == "int8" else None
+        self.codebooks = np.load(os.path.join(path, "codebooks.npy")) if self.encoding == "pq" else None
+        self.rerank = np.load(os.path.join(path, "exact.npy"), mmap_mode=mode) if rerank else None
+
+        if len(self.codes) != len(self.names) or self.meta.get("count") != len(self.names):
+            raise ValueError(f"Embedding store '{path}' is incomplete.")
+
+        self.dead = np.zeros(len(self.names), dtype=bool)  # Rows superseded since encoding
+        self.extra = ([], np.zeros((0, self.meta["dim"]), dtype=np.float32))  # (names, exact embeddings) not in the codes
+
+    @classmethod
+    def write(cls, path, names, embeddings, encoding="int8", subspaces=PQ_SUBSPACES, codebooks=None, trained=None):
+        """Encodes the embeddings into a new store directory at path and returns its size in bytes.
+
+        For "pq", codebooks (trained on `trained` faces) can be passed in to skip training.
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding '{encoding}', expected one of {ENCODINGS}.")
+
+        names = list(names)
+        if not names:
+            raise ValueError("Cannot encode an empty gallery.")
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(names), -1)
+        vectors, norms = normalize_rows(embeddings)
+        dim = vectors.shape[1]
+        arrays = {"norms": norms.astype(np.float32), "exact": embeddings}
+        meta = {"encoding": encoding, "count": len(names), "dim": dim}
+
+        #  Codes hold the unit vectors: cosine comes from the codes, L2 from the exact norms
+        if encoding == "float16":
+            arrays["codes"] = vectors.astype(np.float16)
+        elif encoding == "int8":
+            scale = np.maximum(np.abs(vectors).max(axis=0) if len(vectors) else np.zeros(dim), EPSILON) / 127.0
+            arrays["scale"] = scale.astype(np.float32)
+            arrays["codes"] = np.clip(np.round(vectors / scale), -127, 127).astype(np.int8)
+        else:
+            if codebooks is None:
+                codebooks, trained = train_pq(vectors, math.gcd(dim, subspaces)), len(names)
+            arrays["codebooks"] = codebooks
+            arrays["codes"] = encode_pq(vectors, codebooks)
+            meta["subspaces"] = len(codebooks)
+            meta["trained"] = trained
+
+        #  Write into a sibling directory and rename it into place, so readers never see a partial store
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+        with open(os.path.join(tmp_path, "names.json"), "w") as file:
+            json.dump(names, file)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as file:
+            json.dump(meta, file, indent=4)
+        os.replace(tmp_path, path)
+
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    def __len__(self):
+        return len(self.names) - int(self.dead.sum()) + len(self.extra[0])
+
+    @property
+    def pending(self):
+        """Faces whose current embedding is outside the codes (masked rows plus extra rows)."""
+        return int(self.dead.sum()) + len(self.extra[0])
+
+    def apply(self, index, summary):
+        """Applies an EmbeddingIndex.update() summary without re-encoding."""
+        changed = summary["added"] + summary["changed"]
+        gone = set(summary["removed"]) | set(changed)
+        dead = self.dead.copy()
+        dead[[self.rows[name] for name in gone if name in self.rows]] = True
+
+        names, vectors = self.extra
+        keep = [i for i, name in enumerate(names) if name not in gone]
+        rows = {name: i for i, name in enumerate(index.names)}
+        present = [name for name in changed if name in rows]
+        new = np.asarray(index.embeddings[[rows[name] for name in present]], dtype=np.float32).reshape(len(present), -1)
+
+        #  Swap whole objects so a concurrent search sees either the old or the new state
+        self.extra = ([names[i] for i in keep] + present, np.concatenate([vectors[keep], new]))
+        self.dead = dead
+
+    def _approximate_cosine(self, unit):
+        """Cosine similarity of every row, computed block by block on the quantized codes."""
+        cosine = np.empty(len(self.names), dtype=np.float32)
+        if self.encoding == "pq":
+            width = self.codebooks.shape[2]
+            #  Asymmetric distance: one lookup table of query/codeword dot products per sub-vector
+            table = np.einsum("mcd,md->mc", self.codebooks, unit.reshape(-1, width))
+            rows = np.arange(len(table))
+            for start in range(0, len(cosine), CHUNK_ROWS):
+                cosine[start:start + CHUNK_ROWS] = table[rows, self.codes[start:start + CHUNK_ROWS]].sum(axis=1)
+            return cosine
+
+        weights = unit * self.scale if self.encoding == "int8" else unit
+        for start in range(0, len(cosine), CHUNK_ROWS):
+            cosine[start:start + CHUNK_ROWS] = self.codes[start:start + CHUNK_ROWS].astype(np.float32) @ weights
+        return cosine
+
+    def search(self, query, k=5, rerank=True, names=None):
+        """Returns the top-k candidates ranked on the codes, with the shortlist re-scored exactly if rerank is set.
+
+        names, if given, limits the search to those gallery photos.
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query_norm = float(np.linalg.norm(query))
+        unit = query / max(query_norm, EPSILON)
+
+        candidates = self._search_codes(unit, query_norm, k, rerank, names)
+        extra = self._search_extra(unit, query_norm, k, names)
+        if extra:
+            candidates = sorted(candidates + extra, key=lambda candidate: (-candidate.cosine, candidate.distance))[:k]
+        return candidates
+
+    def _search_extra(self, unit, query_norm, k, names):
+        """Exact top-k over the faces applied since encoding."""
+        extra_names, vectors = self.extra
+        rows = np.arange(len(extra_names)) if names is None else subset_rows({name: i for i, name in enumerate(extra_names)}, names)
+        if not len(rows):
+            return []
+        norms = np.linalg.norm(vectors[rows], axis=1)
+        cosine = (vectors[rows] @ unit) / np.maximum(norms, EPSILON)
+        return rank_top_k(extra_names, self.image_folder, rows, cosine, l2_from_cosine(cosine, norms, query_norm), k)
+
+    def _search_codes(self, unit, query_norm, k, rerank, names):
+        dead = self.dead
+        rows = np.arange(len(self.names)) if names is None else subset_rows(self.rows, names)
+        rows = rows[~dead[rows]]
+        if not len(rows):
+            return []
+
+        cosine = self._approximate_cosine(unit)
+        if names is not None or dead.any():
+            cosine = cosine[rows]
+
+        if not (rerank and self.rerank is not None):
+            distance = l2_from_cosine(cosine, self.norms[rows], query_norm)
+            return rank_top_k(self.names, self.image_folder, rows, cosine, distance, k)
+
+        #  Exact re-score of a shortlist picked on the codes
+        size = min(len(rows), k * RERANK_FACTOR)
+        shortlist = rows[np.sort(np.argpartition(-cosine, size - 1)[:size])] if size < len(rows) else rows
+        exact = np.asarray(self.rerank[shortlist], dtype=np.float32)
+        norms = np.linalg.norm(exact, axis=1)
+        cosine = (exact @ unit) / np.maximum(norms, EPSILON)
+        distance = l2_from_cosine(cosine, norms, query_norm)
+        return rank_top_k(self.names, self.image_folder, shortlist, cosine, distance, k)
+
+def store_path(index, encoding, key):
+    return os.path.join(index.index_dir, f"{index.model_name}_{encoding}_{key}")
+
+def open_store(index, encoding="int8", rerank=True, previous=None, summary=None):
+    """Opens the store for an EmbeddingIndex's current contents, encoding it first if needed.
+
+    A previous store is kept and updated in place from the update summary until too much of
+    the gallery sits outside its codes; re-encoding then reuses its PQ codebooks unless the
+    gallery has outgrown them. Stores are immutable on disk and named by content hash, so an
+    open memmap is never overwritten; stores of older gallery versions are removed when a new
+    one is written. An empty gallery gets an exact search engine instead.
+    """
+    if not len(index):
+        return SearchEngine.from_index(index)
+
+    codebooks = trained = None
+    if isinstance(previous, EmbeddingStore) and previous.encoding == encoding and summary is not None:
+        if any(summary.values()):
+            previous.apply(index, summary)
+        if previous.pending <= max(REENCODE_MIN, REENCODE_RATIO * len(index)):
+            return previous
+        trained = previous.meta.get("trained")
+        if encoding == "pq" and trained and len(index) <= PQ_RETRAIN_GROWTH * trained:
+            codebooks = np.asarray(previous.codebooks)
+
+    path = store_path(index, encoding, fingerprint(index.names, index.embeddings))
+    if not os.path.exists(os.path.join(path, "exact.npy")):
+        shutil.rmtree(path, ignore_errors=True)  # A store written before exact embeddings were kept
+        print(f"Encoding {len(index)} embeddings as {encoding}...")
+        size = EmbeddingStore.write(path, index.names, index.embeddings, encoding, codebooks=codebooks, trained=trained)
+        print(f"Embedding store written to '{path}' ({size / (1024 * 1024):.1f} MB).")
+
+        prefix = os.path.basename(store_path(index, encoding, ""))
+        for name in os.listdir(index.index_dir):
+            old = os.path.join(index.index_dir, name)
+            if name.startswith(prefix) and old != path:
+                shutil.rmtree(old, ignore_errors=True)  # Still mapped elsewhere on Windows; retried next time
+
+    return EmbeddingStore(path, index.image_folder, rerank=rerank)
+
+if __name__ == "__main__":
+    from embedding_index import load_index
+
+    encoding = sys.argv[1] if len(sys.argv) > 1 else "int8"
+    index = load_index()
+    store = open_store(index, encoding, rerank=False)
+    exact = SearchEngine.from_index(index)
+
+    #  Recall@10 of the codes alone against exact search, using gallery faces as queries
+    queries = index.embeddings[:: max(1, len(index) // 200)]
+    overlap = [len({c.name for c in store.search(q, 10)} & {c.name for c in exact.search(q, 10)}) / 10 for q in queries]
+    print(f"{encoding}: recall@10 vs exact {np.mean(overlap):.3f} over {len(queries)} queries")
@@ -0,0 +1,45 @@
+import os
+import threading
+import numpy as np
+from PIL import Image
+from reconstruction_cache import cache_key
+
+CACHE_DIR = "cache/faces"
+
+class FaceCache:
+    """Detected and aligned gallery faces, stored once per photo as PNG crops keyed by file hash and detector.
+
+    The crops are model independent, so building embeddings for another model skips face
+    detection for every photo that has been seen before.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def path_for(self, image_path, detector_backend):
+        key = cache_key(image_path, detector=detector_backend, align=True)
+        return os.path.join(self.cache_dir, detector_backend, key + ".png")
+
+    def face(self, image_path, detector_backend, detect):
+        """The aligned face of a photo as a float RGB array in [0, 1]; detect(image_path) runs on a miss."""
+        cached_path = self.path_for(image_path, detector_backend)
+        try:
+            with Image.open(cached_path) as img:
+                return np.asarray(img.convert("RGB"), dtype=np.float32) / 255.0
+        except OSError:
+            pass
+
+        face = detect(image_path)
+        if face is None:
+            return None
+
+        #  Return the stored 8-bit pixels so a hit and a miss give a model the same input
+        pixels = (np.clip(face, 0, 1) * 255).round().astype(np.uint8)
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+        Image.fromarray(pixels).save(tmp_path, format="PNG")
+        os.replace(tmp_path, cached_path)
+        return pixels.astype(np.float32) / 255.0
+
+#  Shared by every embedder
+face_cache = FaceCache()
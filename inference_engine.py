@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import threading
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+
+IMAGE_SHAPE = (256, 256, 3)
+BACKENDS = ("keras", "savedmodel", "tflite")
+QUANTIZATIONS = (None, "float16", "int8")
+
+#  Largest acceptable absolute difference from the .h5 model's outputs, per quantization
+PARITY_TOLERANCE = {None: 1e-4, "float16": 2e-2, "int8": 1e-1}
+
+def _vae_parts(model):
+    """Returns the (encoder, decoder) sub-models of the VAE, or None if they cannot be found."""
+    try:
+        return model.get_layer("encoder"), model.get_layer("decoder")
+    except ValueError:
+        return None
+
+def _source_signature(model_path):
+    """Identifies the .h5 file an artifact was converted from."""
+    stat = os.stat(model_path)
+    return {"source": os.path.basename(model_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+def artifact_path(model_path, backend, quantization=None):
+    """Path of the converted artifact stored next to the .h5 file."""
+    base = os.path.splitext(model_path)[0]
+    if backend == "savedmodel":
+        return base + "_savedmodel"
+    return base + (f"_{quantization}" if quantization else "") + "_tflite"
+
+class KerasEngine:
+    """The eager Keras model as loaded from the .h5 file."""
+
+    name = "keras"
+
+    def __init__(self, model):
+        self.model = model
+        parts = _vae_parts(model)
+        self.has_latent = parts is not None
+        if parts:
+            self.encoder, self.decoder = parts
+
+    def encode(self, images):
+        """Returns (z_mean, z_log_sigma) for a batch of images."""
+        z_mean, z_log_sigma, _ = self.encoder(images, training=False)
+        return np.asarray(z_mean), np.asarray(z_log_sigma)
+
+    def decode(self, z):
+        """Decodes a batch of latent vectors into images."""
+        return np.asarray(self.decoder(z, training=False))
+
+    def reconstruct(self, images):
+        """Runs the full VAE, including the random `sampling` layer."""
+        return np.asarray(self.model(images, training=False))
+
+class VAEModule(tf.Module):
+    """Traced VAE graphs with fixed input signatures, exportable as a SavedModel."""
+
+    def __init__(self, model, jit_compile=False):
+        super().__init__()
+        self.model = model
+        parts = _vae_parts(model)
+        image_spec = tf.TensorSpec((None,) + IMAGE_SHAPE, tf.float32)
+
+        def reconstruct(images):
+            return model(images, training=False)
+
+        self.reconstruct = tf.function(reconstruct, input_signature=[image_spec], jit_compile=jit_compile)
+
+        if parts:
+            encoder, decoder = parts
+            latent_spec = tf.TensorSpec((None, decoder.input_shape[-1]), tf.float32)
+
+            #  z_mean and z_log_sigma travel as one tensor so every backend keeps their order
+            def encode(images):
+                z_mean, z_log_sigma, _ = encoder(images, training=False)
+                return tf.concat([z_mean, z_log_sigma], axis=-1)
+
+            def decode(z):
+                return decoder(z, training=False)
+
+            self.encode = tf.function(encode, input_signature=[image_spec], jit_compile=jit_compile)
+            self.decode = tf.function(decode, input_signature=[latent_spec], jit_compile=jit_compile)
+
+class CompiledEngine:
+    """Runs a VAEModule, either freshly traced or loaded back from a SavedModel."""
+
+    name = "savedmodel"
+
+    def __init__(self, module):
+        self.module = module
+        self.has_latent = hasattr(module, "encode") and hasattr(module, "decode")
+
+    def encode(self, images):
+        return np.split(self.module.encode(tf.convert_to_tensor(images, tf.float32)).numpy(), 2, axis=-1)
+
+    def decode(self, z):
+        return self.module.decode(tf.convert_to_tensor(z, tf.float32)).numpy()
+
+    def reconstruct(self, images):
+        return self.module.reconstruct(tf.convert_to_tensor(images, tf.float32)).numpy()
+
+class TFLiteEngine:
+    """Runs TFLite conversions of the encoder and decoder."""
+
+    name = "tflite"
+    has_latent = True
+
+    def __init__(self, encoder_path, decoder_path):
+        self.encoder = tf.lite.Interpreter(model_path=encoder_path)
+        self.decoder = tf.lite.Interpreter(model_path=decoder_path)
+        self.lock = threading.Lock()  # Interpreters are not thread-safe
+
+    @staticmethod
+    def _run(interpreter, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        input_index = interpreter.get_input_details()[0]["index"]
+        interpreter.resize_tensor_input(input_index, batch.shape)
+        interpreter.allocate_tensors()
+        interpreter.set_tensor(input_index, batch)
+        interpreter.invoke()
+        return [interpreter.get_tensor(output["index"]) for output in interpreter.get_output_details()]
+
+    def encode(self, images):
+        with self.lock:
+            return np.split(self._run(self.encoder, images)[0], 2, axis=-1)
+
+    def decode(self, z):
+        with self.lock:
+            return self._run(self.decoder, z)[0]
+
+    def reconstruct(self, images):
+        """Encodes, samples the latent like the `sampling` layer, and decodes."""
+        z_mean, z_log_sigma = self.encode(images)
+        epsilon = np.random.normal(size=z_mean.shape).astype(np.float32)
+        return self.decode(z_mean + np.exp(z_log_sigma / 2) * epsilon)
+
+def convert_tflite(module, quantization=None, latent_dim=None):
+    """Converts the encode/decode graphs to TFLite flatbuffers, optionally quantized."""
+    def converter_for(function, representative):
+        converter = tf.lite.TFLiteConverter.from_concrete_functions([function.get_concrete_function()], module)
+        if quantization == "float16":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantization == "int8":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = representative
+        return converter.convert()
+
+    rng = np.random.default_rng(0)
+
+    def image_samples():
+        for _ in range(16):
+            yield [rng.random((1,) + IMAGE_SHAPE, dtype=np.float32)]
+
+    def latent_samples():
+        for _ in range(64):
+            yield [rng.standard_normal((1, latent_dim)).astype(np.float32)]
+
+    return converter_for(module.encode, image_samples), converter_for(module.decode, latent_samples)
+
+def check_parity(engine, reference, num_samples=4, seed=0, tolerance=None):
+    """Compares an engine's encode/decode outputs with the reference Keras engine on the same inputs."""
+    rng = np.random.default_rng(seed)
+    images = rng.random((num_samples,) + IMAGE_SHAPE, dtype=np.float32)
+    report = {"engine": engine.name}
+
+    if engine.has_latent and reference.has_latent:
+        ref_mean, ref_log_sigma = reference.encode(images)
+        mean, log_sigma = engine.encode(images)
+        report["encode_max_abs"] = float(max(np.abs(mean - ref_mean).max(), np.abs(log_sigma - ref_log_sigma).max()))
+
+        z = rng.standard_normal(ref_mean.shape).astype(np.float32)
+        report["decode_max_abs"] = float(np.abs(engine.decode(z) - reference.decode(z)).max())
+    else:
+        #  The full VAE samples internally, so only the output shape can be compared
+        output = engine.reconstruct(images)
+        report["reconstruct_shape_ok"] = output.shape == reference.reconstruct(images).shape
+
+    #  A drifting encoder shifts every latent sample, so its error counts as much as the decoder's
+    error = max(report.get("encode_max_abs", 0.0), report.get("decode_max_abs", 0.0))
+    report["ok"] = bool(report.get("reconstruct_shape_ok", True)) and (tolerance is None or error <= tolerance)
+    return report
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json"), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(path, meta):
+    with open(os.path.join(path, "meta.json"), "w") as file:
+        json.dump(meta, file, indent=4)
+
+def build_artifact(model_path, custom_objects, backend, jit_compile=False, quantization=None):
+    """Converts the .h5 model, verifies parity and saves the artifact; returns (engine, report)."""
+    reference = KerasEngine(load_model(model_path, custom_objects=custom_objects, compile=False))
+    module = VAEModule(reference.model, jit_compile=jit_compile)
+    path = artifact_path(model_path, backend, quantization)
+    os.makedirs(path, exist_ok=True)
+
+    if backend == "savedmodel":
+        tf.saved_model.save(module, path)
+        engine = CompiledEngine(module)
+    else:
+        if not reference.has_latent:
+            raise ValueError("TFLite conversion needs the VAE's encoder and decoder sub-models.")
+        encoder_bytes, decoder_bytes = convert_tflite(module, quantization, reference.decoder.input_shape[-1])
+        with open(os.path.join(path, "encoder.tflite"), "wb") as file:
+            file.write(encoder_bytes)
+        with open(os.path.join(path, "decoder.tflite"), "wb") as file:
+            file.write(decoder_bytes)
+        engine = TFLiteEngine(os.path.join(path, "encoder.tflite"), os.path.join(path, "decoder.tflite"))
+
+    report = check_parity(engine, reference, tolerance=PARITY_TOLERANCE[quantization])
+    meta = dict(_source_signature(model_path), backend=backend, jit_compile=jit_compile,
+                quantization=quantization, parity=report)
+    _write_meta(path, meta)
+    return (engine if report["ok"] else reference), report
+
+def load_engine(model_path, custom_objects=None, backend="savedmodel", jit_compile=False, quantization=None):
+    """Returns an inference engine, reusing a cached converted artifact when it is still valid.
+
+    The first start converts the .h5 file and checks parity against it; later starts load
+    the artifact directly and skip HDF5 parsing and retracing. Any failure falls back to
+    the plain Keras model; a failed parity check is remembered until the .h5 file changes.
+    """
+    if backend not in BACKENDS or quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown inference backend {backend!r} / quantization {quantization!r}.")
+
+    if backend == "keras":
+        return KerasEngine(load_model(model_path, custom_objects=custom_objects, compile=False))
+
+    path = artifact_path(model_path, backend, quantization)
+    meta = _read_meta(path)
+    expected = dict(_source_signature(model_path), backend=backend, jit_compile=jit_compile, quantization=quantization)
+
+    if meta and all(meta.get(key) == value for key, value in expected.items()):
+        #  This exact model already failed conversion; converting again would fail the same way
+        if not meta["parity"]["ok"]:
+            print(f"The {backend} conversion of '{model_path}' failed its parity check earlier, using the Keras model.")
+            return KerasEngine(load_model(model_path, custom_objects=custom_objects, compile=False))
+        try:
+            if backend == "savedmodel":
+                return CompiledEngine(tf.saved_model.load(path))
+            return TFLiteEngine(os.path.join(path, "encoder.tflite"), os.path.join(path, "decoder.tflite"))
+        except Exception as e:
+            print(f"Could not load cached {backend} model from '{path}', rebuilding: {e}")
+
+    try:
+        engine, report = build_artifact(model_path, custom_objects, backend, jit_compile, quantization)
+    except Exception as e:
+        print(f"Could not convert '{model_path}' to {backend}, using the Keras model: {e}")
+        return KerasEngine(load_model(model_path, custom_objects=custom_objects, compile=False))
+
+    if not report["ok"]:
+        print(f"{backend} model failed the parity check, using the Keras model: {report}")
+    else:
+        print(f"Converted '{model_path}' to {backend} at '{path}' (parity: {report}).")
+    return engine
+
+if __name__ == "__main__":
+    #  Re-run the parity check of a cached artifact: python inference_engine.py [backend] [quantization]
+    import run_model
+
+    backend = sys.argv[1] if len(sys.argv) > 1 else run_model.INFERENCE_BACKEND
+    quantization = sys.argv[2] if len(sys.argv) > 2 else None
+    engine = load_engine(run_model.MODEL_PATH, {"sampling": run_model.sampling}, backend, quantization=quantization)
+    reference = KerasEngine(load_model(run_model.MODEL_PATH, custom_objects={"sampling": run_model.sampling}, compile=False))
+    print(json.dumps(check_parity(engine, reference, tolerance=PARITY_TOLERANCE[quantization]), indent=4))
@@ -0,0 +1,79 @@
+import queue
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+#  Stages a job can report, in the order they normally happen
+STAGES = ("queued", "loading models", "reconstructing", "embedding", "searching", "re-ranking", "done", "failed")
+POLL_INTERVAL_MS = 100
+
+class JobRunner:
+    """Runs jobs on a worker pool and reports their progress through a thread-safe queue.
+
+    A job is any callable accepting a ``progress`` keyword; calling ``progress(stage)``
+    from the worker posts ``(job_id, stage, None)`` to ``events``. Completion posts
+    ``(job_id, "done", result)`` and an exception posts ``(job_id, "failed", error)``.
+    """
+
+    def __init__(self, max_workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sketch-job")
+        self.events = queue.Queue()
+        self.names = {}
+        self._ids = itertools.count(1)
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        """Number of jobs queued or running."""
+        return self._active
+
+    def submit(self, func, *args, name=None, **kwargs):
+        """Queues func(*args, progress=..., **kwargs) and returns its job id."""
+        job_id = next(self._ids)
+        self.names[job_id] = name or f"Job {job_id}"
+
+        with self._lock:
+            self._active += 1
+        self.events.put((job_id, "queued", None))
+
+        def progress(stage, payload=None):
+            self.events.put((job_id, stage, payload))
+
+        def run():
+            try:
+                result = func(*args, progress=progress, **kwargs)
+            except Exception as e:
+                event = (job_id, "failed", e)
+            else:
+                event = (job_id, "done", result)
+            with self._lock:
+                self._active -= 1
+            self.events.put(event)
+
+        self.executor.submit(run)
+        return job_id
+
+    def poll(self):
+        """Returns every event posted since the last poll without blocking."""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def shutdown(self, wait=False):
+        """Stops accepting jobs; queued jobs are cancelled unless wait is True."""
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+def poll_with_tk(widget, runner, handler, interval_ms=POLL_INTERVAL_MS):
+    """Delivers runner events to handler(job_id, stage, payload) on the Tk thread via after()."""
+    def tick():
+        if not widget.winfo_exists():
+            return
+        for job_id, stage, payload in runner.poll():
+            handler(job_id, stage, payload)
+        widget.after(interval_ms, tick)
+
+    widget.after(interval_ms, tick)
@@ -0,0 +1,254 @@
+import os
+import json
+import numpy as np
+from PIL import Image
+from embedding_index import INDEX_DIR, IMAGE_DIR, scan_images
+
+#  Shipped landmark files: CUHK ".dat" files (35 integer points) and ".3pts" files (eyes and mouth)
+POINT_EXTENSIONS = (".dat", ".3pts")
+GALLERY_POINT_DIRS = ("Kaggle/photo", "Kaggle/photo_points")
+SKETCH_POINT_DIRS = ("Kaggle/sketch", "Kaggle/sketch_points")
+DETECTOR_BACKEND = "mtcnn"  # Used for images without a point file; must report eye and mouth positions
+
+FULL_POINTS = 35
+DAT_EYES = (16, 18)             # Eye centres in the 35-point layout
+DAT_MOUTH = (22, 23, 24, 25)    # Mouth corners and lip midpoints in the 35-point layout
+
+PREFILTER_KEEP = 0.5  # Share of the gallery passed on to the embedding comparison
+PREFILTER_MIN = 50    # ...but never fewer than this many photos
+
+def read_points(path):
+    """Reads an "x y" per line point file into an (n, 2) float array."""
+    with open(path, "r") as file:
+        values = [float(value) for value in file.read().split()]
+    if not values or len(values) % 2:
+        raise ValueError(f"Malformed point file '{path}'.")
+    return np.asarray(values, dtype=np.float32).reshape(-1, 2)
+
+def find_points(image_path, point_dirs=()):
+    """Point file for an image: next to it or in point_dirs, matched by file stem. None if there is none."""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    for folder in (os.path.dirname(image_path),) + tuple(point_dirs):
+        for extension in POINT_EXTENSIONS:
+            path = os.path.join(folder, stem + extension)
+            if os.path.exists(path):
+                return path
+    return None
+
+def detect_points(image):
+    """Left eye, right eye and mouth centre (in image order) from the face detector, or None."""
+    from deepface import DeepFace
+
+    try:
+        faces = DeepFace.extract_faces(image, detector_backend=DETECTOR_BACKEND, enforce_detection=False)
+    except Exception as e:
+        print(f"Landmark detection failed: {e}")
+        return None
+
+    area = faces[0].get("facial_area", {}) if faces else {}
+    eyes = [area.get("left_eye"), area.get("right_eye")]
+    mouth = [area.get("mouth_left"), area.get("mouth_right")]
+    if None in eyes or None in mouth:
+        return None
+    eyes = sorted(eyes)  # The detector names eyes from the subject's side; point files go left to right
+    return np.asarray(eyes + [np.mean(mouth, axis=0)], dtype=np.float32)
+
+def three_points(points):
+    """Reduces a point set to the shared eyes-and-mouth layout of the .3pts files."""
+    if len(points) == 3:
+        return points
+    return np.stack([points[DAT_EYES[0]], points[DAT_EYES[1]], points[list(DAT_MOUTH)].mean(axis=0)])
+
+def describe(points):
+    """Scale- and rotation-invariant shape descriptor: log inter-point distances over their RMS."""
+    distances = np.linalg.norm(points[:, None] - points[None, :], axis=2)[np.triu_indices(len(points), 1)]
+    return np.log(np.maximum(distances, 1e-6) / max(np.sqrt((distances ** 2).mean()), 1e-6))
+
+def standardize(values):
+    """Z-scores of the non-NaN values; NaN stays NaN."""
+    valid = values[~np.isnan(values)]
+    if len(valid) < 2:
+        return np.where(np.isnan(values), np.nan, 0.0)
+    return (values - valid.mean()) / max(float(valid.std()), 1e-6)
+
+class LandmarkIndex:
+    """Facial landmarks and shape descriptors for every gallery photo, kept in step with the folder.
+
+    Points are imported from the shipped .dat/.3pts files where one exists and detected otherwise.
+    """
+
+    def __init__(self, image_folder=IMAGE_DIR, point_dirs=GALLERY_POINT_DIRS, index_dir=INDEX_DIR, detect=True):
+        self.image_folder = image_folder
+        self.point_dirs = point_dirs
+        self.index_dir = index_dir
+        self.detect = detect
+        self.entries = {}  # name -> {"size", "mtime", "source", "points"}
+        self.names = []
+        self.full = np.zeros((0, 0), dtype=np.float32)
+        self.reduced = np.zeros((0, 3), dtype=np.float32)
+
+    @property
+    def path(self):
+        return os.path.join(self.index_dir, "landmarks.json")
+
+    def load(self):
+        try:
+            with open(self.path, "r") as file:
+                self.entries = json.load(file)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable landmark index '{self.path}': {e}")
+            return False
+        self._build()
+        return True
+
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.path)
+
+    def _landmarks(self, name):
+        """Imports or detects the points of one gallery photo; returns (source, points or None)."""
+        image_path = os.path.join(self.image_folder, name)
+        point_file = find_points(image_path, self.point_dirs)
+        if point_file:
+            try:
+                return os.path.basename(point_file), read_points(point_file)
+            except (OSError, ValueError) as e:
+                print(f"Skipping point file for {name}: {e}")
+        if self.detect:
+            return "detected", detect_points(image_path)
+        return None, None
+
+    def _entry(self, name, stat):
+        source, points = self._landmarks(name)
+        #  Photos without landmarks are remembered too, so detection is not retried every time
+        return dict(stat, source=source, points=points.tolist() if points is not None else None)
+
+    def add_photo(self, name):
+        """Imports or detects the landmarks of one new or replaced photo without scanning the folder."""
+        if not self.entries:
+            self.load()
+
+        stat = os.stat(os.path.join(self.image_folder, name))
+        self.entries[name] = self._entry(name, {"size": stat.st_size, "mtime": stat.st_mtime})
+        self.save()
+
+        full, reduced = self._descriptors(self.entries[name]["points"])
+        if name in self.names:
+            row = self.names.index(name)
+            self.full[row], self.reduced[row] = full, reduced
+        else:
+            self.names.append(name)
+            self.full = np.concatenate([self.full.reshape(-1, len(full)), full[None]])
+            self.reduced = np.concatenate([self.reduced, reduced[None]])
+
+    def update(self):
+        """Imports or detects landmarks for new and changed photos; returns the number updated."""
+        if not self.entries:
+            self.load()
+
+        current = scan_images(self.image_folder)
+        updated = 0
+        entries = {}
+        for name, stat in current.items():
+            entry = self.entries.get(name)
+            if entry and entry["size"] == stat["size"] and entry["mtime"] == stat["mtime"]:
+                entries[name] = entry
+                continue
+            entries[name] = self._entry(name, stat)
+            updated += 1
+
+        if updated or len(entries) != len(self.entries):
+            self.entries = entries
+            self.save()
+            print(f"Landmarks updated for {updated} photos ({len(self.entries)} total).")
+            self._build()
+        elif len(self.names) != len(self.entries):
+            self._build()
+        return updated
+
+    def _build(self):
+        """Precomputes the full-layout and eyes-and-mouth descriptors of every photo."""
+        self.names = sorted(self.entries)
+        size = FULL_POINTS * (FULL_POINTS - 1) // 2
+        self.full = np.full((len(self.names), size), np.nan, dtype=np.float32)
+        self.reduced = np.full((len(self.names), 3), np.nan, dtype=np.float32)
+        for row, name in enumerate(self.names):
+            self.full[row], self.reduced[row] = self._descriptors(self.entries[name]["points"])
+
+    @staticmethod
+    def _descriptors(points):
+        """Full-layout and eyes-and-mouth descriptors of one photo; NaN where the points do not allow one."""
+        full = np.full(FULL_POINTS * (FULL_POINTS - 1) // 2, np.nan, dtype=np.float32)
+        reduced = np.full(3, np.nan, dtype=np.float32)
+        if points is not None:
+            points = np.asarray(points, dtype=np.float32)
+            if len(points) >= FULL_POINTS:
+                full = describe(points[:FULL_POINTS])
+            if len(points) == 3 or len(points) >= FULL_POINTS:
+                reduced = describe(three_points(points))
+        return full, reduced
+
+    def distances(self, query_points):
+        """Descriptor distance to every photo, NaN where a photo has no landmarks.
+
+        Uses all 35 points when both sides have them and the eyes-and-mouth layout otherwise.
+        The two layouts average over different numbers of terms, so when both occur each is
+        standardized over its own photos before they are ranked together.
+        """
+        query_points = np.asarray(query_points, dtype=np.float32)
+        if len(query_points) != 3 and len(query_points) < FULL_POINTS:
+            return np.full(len(self.names), np.nan, dtype=np.float32)
+        reduced = np.abs(self.reduced - describe(three_points(query_points))).mean(axis=1)
+        if len(query_points) < FULL_POINTS:
+            return reduced
+
+        full = np.abs(self.full - describe(query_points[:FULL_POINTS])).mean(axis=1)
+        has_full = ~np.isnan(full)
+        if has_full.all():
+            return full
+        return np.where(has_full, standardize(full), standardize(np.where(has_full, np.nan, reduced)))
+
+    def shortlist(self, query_points, keep=PREFILTER_KEEP, minimum=PREFILTER_MIN):
+        """Names of the photos whose geometry is closest to the query; photos without landmarks always pass."""
+        distances = self.distances(query_points)
+        known = np.flatnonzero(~np.isnan(distances))
+        count = max(minimum, int(np.ceil(keep * len(self.names))))
+        if count < len(known):
+            known = known[np.argpartition(distances[known], count - 1)[:count]]
+        unknown = np.flatnonzero(np.isnan(distances))
+        return [self.names[row] for row in np.concatenate([known, unknown])]
+
+def image_size(image):
+    """(width, height) of an image path or array."""
+    if isinstance(image, str):
+        with Image.open(image) as img:
+            return img.size
+    return image.shape[1], image.shape[0]
+
+def query_points(sketch_path, image=None, point_dirs=SKETCH_POINT_DIRS, use_files=True):
+    """Landmarks of a query: the sketch's own point file if there is one, else detected on image.
+
+    The reconstruction is square while sketches are not, so detected points are scaled back to
+    the sketch's own width and height; the descriptors are not invariant to that stretch.
+    """
+    point_file = find_points(sketch_path, point_dirs) if sketch_path and use_files else None
+    if point_file:
+        try:
+            return read_points(point_file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring point file '{point_file}': {e}")
+    if image is None:
+        return None
+
+    points = detect_points(image)
+    if points is not None and sketch_path:
+        try:
+            points = points * np.asarray(image_size(sketch_path), dtype=np.float32) / np.asarray(image_size(image), dtype=np.float32)
+        except OSError as e:
+            print(f"Could not read the size of '{sketch_path}': {e}")
+    return points
@@ -98,6 +98,7 @@ def verify_login(username, password):
     return False
 
 notify_main = None  # Placeholder function, set from main.py
+notify_shown = None  # Called once the login window is on screen, set from main.py
 
 def handle_login():
     """Handles login and notifies main.py"""
@@ -110,6 +111,11 @@ def set_notify_callback(callback):
     global notify_main
     notify_main = callback
 
+def set_shown_callback(callback):
+    """Allows main.py to register a callback for when the login window is first drawn"""
+    global notify_shown
+    notify_shown = callback
+
 def login():
     """Handles user login and returns True if successful."""
     username = username_entry.get().strip()
@@ -224,6 +230,9 @@ def show_login_page():
     register_link.bind("<Button-1>", lambda e: show_signup_page())
     cmf.add_footer(login_window)
 
+    if notify_shown:  # Runs after the window has been drawn
+        login_window.after_idle(notify_shown)
+
     login_window.mainloop()
 
 # Initialize the database
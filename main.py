@@ -1,23 +1,33 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
 import os
-import run_model
+import time
 import shutil
-import subprocess
+import tempfile
+from records import get_store
+from thumbnails import thumbnail_service
+from jobs import JobRunner, poll_with_tk
+from metrics import span, traced, tracer
+from warmup import warmup, show_status
+from workspace import Workspace, remove_stale
 import logging
-import tensorflow as tf
 import warnings
 from pages import view_records, add_criminal_record
-import json
 import login as l
 import common_features as cmf
 
 uploaded_filepath = None
+uploaded_workspace = None  # Holds the uploaded sketch until it is submitted
 dashboard_window = None  # Ensure global reference
+download_button = None
+job_runner = JobRunner()  # Sketch jobs run here, off the Tk event loop
 
-def save_to_logs(original_path, reconstructed_path):
-    """Saves uploaded and reconstructed images in a folder named after the uploaded filename."""
+TRACE_FILE = None  # Set to e.g. "logs/traces.jsonl" to keep a per-query timing trace
+tracer.set_trace_file(TRACE_FILE)
+
+def save_to_logs(original_path, reconstructed_image):
+    """Saves the uploaded sketch and its reconstruction (a float RGB array) in a new folder named after the uploaded filename."""
+    from run_model import save_reconstruction
     logs_dir = "logs"
     os.makedirs(logs_dir, exist_ok=True)  #  Ensure logs directory exists
 
@@ -25,37 +35,34 @@ def save_to_logs(original_path, reconstructed_path):
     original_filename = os.path.basename(original_path)
     file_base_name = os.path.splitext(original_filename)[0]  # Remove file extension
 
-    #  Create a folder using the original filename inside logs/
-    upload_folder = os.path.join(logs_dir, file_base_name)
-    os.makedirs(upload_folder, exist_ok=True)
+    #  Create a folder for this job inside logs/: the filename, the time and a unique suffix,
+    #  so uploads with the same filename never overwrite each other's images
+    upload_folder = tempfile.mkdtemp(prefix=f"{file_base_name}_{time.strftime('%Y%m%d-%H%M%S')}_", dir=logs_dir)
+    folder_name = os.path.basename(upload_folder)
 
     #  Define paths inside the folder
     original_save_path = os.path.join(upload_folder, original_filename)
     reconstructed_filename = f"reconstructed_{original_filename}"
     reconstructed_save_path = os.path.join(upload_folder, reconstructed_filename)
 
-    #  Copy images to the folder
+    #  Write images to the folder
     shutil.copy(original_path, original_save_path)
-    shutil.copy(reconstructed_path, reconstructed_save_path)
+    save_reconstruction(reconstructed_image, reconstructed_save_path)
 
     #  Save log entry
-    log_entry = f"Upload '{original_filename}': Stored in logs/{file_base_name}/\n"
+    log_entry = f"Upload '{original_filename}': Stored in logs/{folder_name}/\n"
     with open(os.path.join(logs_dir, "log.txt"), "a") as log_file:
         log_file.write(log_entry)
 
-    print(f"Saved in logs/{file_base_name}/: {original_filename}, {reconstructed_filename}")
+    print(f"Saved in logs/{folder_name}/: {original_filename}, {reconstructed_filename}")
+    return original_save_path, reconstructed_save_path
 
 def display_images(uploaded_path, best_image_path, compared_image_path, uploaded_name, reconstructed_name, compared_name, accuracy):
     """Displays images and filenames in GUI."""
     for img_path, label in zip([uploaded_path, best_image_path, compared_image_path], 
                                [uploaded_label, generated_label, compared_label]):
-        if img_path and os.path.exists(img_path):
-            img = Image.open(img_path).resize((500, 500), Image.LANCZOS)
-            img = ImageTk.PhotoImage(img)
-            label.config(image=img)
-            label.image = img
-        else:
-            label.config(text="No Image Found")
+        # Decoded off the UI thread; a placeholder shows until the image is ready
+        thumbnail_service.show(label, img_path, (500, 500))
 
     #  Update labels with filenames & accuracy
     uploaded_filename_label.config(text=f"Uploaded Sketch: {uploaded_name}")
@@ -79,6 +86,11 @@ def open_dashboard():
 
     tk.Label(dashboard_window, text="Dashboard", font=("Arial", 20, "bold"), bg="#f0f0f0").pack(pady=20)
 
+    # Model readiness, updated while the background warm-up runs
+    readiness_label = tk.Label(dashboard_window, font=("Arial", 12), bg="black")
+    readiness_label.pack()
+    show_status(readiness_label, warmup)
+
     button_frame = tk.Frame(dashboard_window, bg="black")
     button_frame.pack(pady=50)
 
@@ -93,8 +105,8 @@ def open_dashboard():
     dashboard_window.mainloop()
 
 def upload_sketch():
-    """Allows user to upload a sketch and saves it in temp directory while keeping its original name."""
-    global uploaded_filepath, uploaded_filename, generate_button
+    """Allows user to upload a sketch and copies it into its own workspace while keeping its original name."""
+    global uploaded_filepath, uploaded_filename, uploaded_workspace, generate_button
 
     try:
         filepath = filedialog.askopenfilename(
@@ -104,9 +116,11 @@ def upload_sketch():
 
         if filepath:
             uploaded_filename = os.path.basename(filepath)  # Extract the original filename
-            temp_dir = "temp"
-            os.makedirs(temp_dir, exist_ok=True)
-            save_path = os.path.join(temp_dir, uploaded_filename)  # Keep the original filename
+            # A sketch that was uploaded but never submitted is replaced
+            if uploaded_workspace:
+                uploaded_workspace.cleanup()
+            uploaded_workspace = Workspace()
+            save_path = uploaded_workspace.file(uploaded_filename)  # Keep the original filename
             shutil.copy(filepath, save_path)
 
             display_sketch(save_path)
@@ -133,10 +147,7 @@ def download_image(image_path):
 def display_sketch(filepath):
     """Displays uploaded sketch in UI."""
     try:
-        sketch_image = Image.open(filepath).resize((500, 500), Image.LANCZOS)
-        photo = ImageTk.PhotoImage(sketch_image)
-        uploaded_label.config(image=photo)
-        uploaded_label.image = photo
+        thumbnail_service.show(uploaded_label, filepath, (500, 500))
     except Exception as e:
         messagebox.showerror("Error", f"Could not display image: {e}")
 
@@ -144,41 +155,29 @@ def display_generated_image(image_path):
     """Displays the generated image in the middle frame."""
     global generated_label
 
-    img = Image.open(image_path)
-    img = img.resize((300, 300))  # Adjust size as needed
-    img = ImageTk.PhotoImage(img)
-
-    generated_label.config(image=img)
-    generated_label.image = img  # Keep a reference to prevent garbage collection
+    thumbnail_service.show(generated_label, image_path, (300, 300))  # Adjust size as needed
 
 def submit_sketch():
-    """Runs the model to generate the reconstructed image and replaces Generate with Download."""
-    global generate_button, download_button
+    """Queues the uploaded sketch for reconstruction and matching on a background worker."""
+    global uploaded_filepath, uploaded_workspace, generate_button
+
+    if not uploaded_filepath:
+        return
 
-    reconstructed_image_path = run_model.generate_best_reconstruction(uploaded_filepath)
-    display_generated_image(reconstructed_image_path)
+    # The job owns the upload's workspace from here on and removes it when it finishes
+    job_runner.submit(run_sketch_pipeline, uploaded_filepath, uploaded_workspace, name=os.path.basename(uploaded_filepath))
+    uploaded_filepath = uploaded_workspace = None
 
-    # Hide generate button
+    # Hide generate button until the next upload
     if generate_button:
         generate_button.pack_forget()
-    
-    # Show download button
-    download_button = tk.Button(generated_frame, text="Download", command=lambda: download_image(reconstructed_image_path), bg="#FFA500", fg="white", padx=20, pady=10)
-    download_button.pack()
-    process_sketch()
 
 def check_criminal_records(image_path, score):
     """Checks if the generated image matches any criminal records and displays the results."""
     try:
-        with open("criminal_records.json", "r") as file:
-            records = json.load(file)
-
-        matched_records = []
-        for record in records:
-            if record["photo"] == os.path.basename(image_path):  # Placeholder condition
-                matched_records.append(record)
-        
-        display_criminal_records(matched_records, score)
+        # Indexed lookup by photo filename
+        record = get_store().find_by_photo(os.path.basename(image_path))
+        display_criminal_records([record] if record else [], score)
     except Exception as e:
         print(f"Error checking criminal records: {e}")
 
@@ -208,70 +207,91 @@ def display_criminal_records(records, score):
     else:
         print("No matching criminal records found.")
     
-def process_sketch():
-    """Handles sketch processing, model execution, and image comparison."""
-    global uploaded_filepath
-    if uploaded_filepath:
-        print(f"Processing sketch: {uploaded_filepath}")
-
-        uploaded_name = os.path.basename(uploaded_filepath)
+@traced("process_sketch")
+def run_sketch_pipeline(sketch_path, workspace, progress=None):
+    """Reconstructs and matches one sketch in its own workspace, then removes it; safe to run off the UI thread."""
+    print(f"Processing sketch: {sketch_path}")
+    try:
+        # The ML stack loads in the background after launch; wait for it here, off the UI thread
+        if not warmup.ready.is_set():
+            if progress:
+                progress("loading models")
+            warmup.wait()
+        import run_model
+        import compare
+        from landmarks import query_points
 
         # Step 1: Generate best reconstructed image
-        best_image_path = run_model.generate_best_reconstruction(uploaded_filepath)
-        reconstructed_name = os.path.basename(best_image_path)
+        if progress:
+            progress("reconstructing")
+        best_image = run_model.reconstruct_sketch(sketch_path)
+
+        # The logs keep the only files, for display and download; the workspace is removed once the job is done
+        with span("save_to_logs"):
+            sketch_path, best_image_path = save_to_logs(sketch_path, best_image)
+
+        # Step 2: Match the in-memory reconstruction against the gallery, prefiltered by face geometry
+        query = compare.to_bgr_uint8(best_image)
+        points = query_points(sketch_path, query) if compare.PREFILTER else None
+        result = compare.get_matcher().match(query, progress=progress, landmarks=points, query_path=best_image_path)
+        return sketch_path, best_image_path, result
+    finally:
+        workspace.cleanup()
+
+def handle_job_event(job_id, stage, payload):
+    """Applies a background job's progress or result to the UI; runs on the Tk thread."""
+    name = job_runner.names.get(job_id, "Sketch")
+    others = job_runner.active - (0 if stage in ("done", "failed") else 1)
+    waiting = f" ({others} more queued)" if others > 0 else ""
+
+    if stage == "done":
+        status_label.config(text=f"{name}: done{waiting}")
+        show_sketch_results(*payload)
+    elif stage == "failed":
+        status_label.config(text=f"{name}: failed{waiting}")
+        messagebox.showerror("Error", f"Failed to process {name}: {payload}")
+    else:
+        status_label.config(text=f"{name}: {stage}...{waiting}")
 
-        save_to_logs(uploaded_filepath, best_image_path)
+def show_sketch_results(sketch_path, best_image_path, result):
+    """Displays a finished job's reconstruction, best match and criminal records."""
+    global download_button
 
-        # Step 2: Run compare.py using subprocess
-        try:
-            result = subprocess.run(["python", "compare.py", best_image_path], capture_output=True, text=True, check=True)
-            output_lines = result.stdout.strip().split("\n")
+    uploaded_name = os.path.basename(sketch_path)
+    reconstructed_name = os.path.basename(best_image_path)
+    display_generated_image(best_image_path)
 
-            print("Output:\n", result.stdout)
+    # Show download button for this reconstruction
+    if download_button and download_button.winfo_exists():
+        download_button.destroy()
+    download_button = tk.Button(generated_frame, text="Download", command=lambda: download_image(best_image_path), bg="#FFA500", fg="white", padx=20, pady=10)
+    download_button.pack()
 
-            #  Extract filename, Cosine Similarity, and Euclidean Distance
-            compared_image_filename, cosine_sim, euclidean_dist = None, 0.0, 0.0
-            for line in output_lines:
-                if "Most similar image:" in line:
-                    compared_image_filename = line.split(": ")[1].strip()
-                elif "Cosine Similarity:" in line:
-                    cosine_sim = float(line.split(": ")[1].split(",")[0].strip())
-                elif "Euclidean Distance:" in line:
-                    euclidean_dist = float(line.split(": ")[1].strip())
+    if not result:
+        print("No valid image found.")
+        messagebox.showwarning("Comparison Failed", "No similar images found.")
+        return
 
-            if not compared_image_filename:
-                print("No valid image found.")
-                messagebox.showwarning("Comparison Failed", "No similar images found.")
-                return
+    compared_image_filename = result.best.name
+    compared_image_path = os.path.abspath(result.best.path)
 
-            image_folder = "Kaggle/photos"
-            compared_image_path = os.path.abspath(os.path.join(image_folder, compared_image_filename))
-            #print(f"Compared Image Path: {compared_image_path}")
+    if not os.path.exists(compared_image_path):
+        messagebox.showwarning("Comparison Failed", "No similar images found.")
+        return
 
-            
-            
-            if not os.path.exists(compared_image_path):
-                messagebox.showwarning("Comparison Failed", "No similar images found.")
-                return
-
-            #  Compute Final Custom Similarity Score
-            max_euclidean = 10  # **You can adjust this based on your dataset**
-            euclidean_scaled = (euclidean_dist / max_euclidean) * 100  # Normalize to 0-100
-            final_score = (cosine_sim * 100) - euclidean_scaled  # **Custom Formula**
-            check_criminal_records(compared_image_filename, final_score)
-        except subprocess.CalledProcessError as e:
-            messagebox.showerror("Error", f"Failed to compare images: {e}")
-            return
-
-        # Step 3: Display images with filenames and final score
-        display_images(uploaded_filepath, best_image_path, compared_image_path, uploaded_name, reconstructed_name, compared_image_filename, final_score)
+    #  Compute Final Custom Similarity Score
+    final_score = result.score
+    check_criminal_records(compared_image_filename, final_score)
+
+    # Step 3: Display images with filenames and final score
+    display_images(sketch_path, best_image_path, compared_image_path, uploaded_name, reconstructed_name, compared_image_filename, final_score)
 
 def draw_faces():
     """Launches the Draw Faces interface and closes the dashboard."""
     global draw_faces_window, dashboard_window
     global uploaded_label, generated_label, compared_label
     global uploaded_filename_label, generated_filename_label, compared_filename_label
-    global generate_button, generated_frame  # Make generated_frame global
+    global generate_button, generated_frame, status_label  # Make generated_frame global
 
     if 'dashboard_window' in globals() and dashboard_window.winfo_exists():
         dashboard_window.destroy()  # Close Dashboard
@@ -321,6 +341,11 @@ def draw_faces():
     generate_button.pack()
     generate_button.pack_forget()  # Hide initially
 
+    # Progress of queued sketch jobs
+    status_label = tk.Label(generated_frame, text="", bg="white", fg="gray")
+    status_label.pack()
+    poll_with_tk(draw_faces_window, job_runner, handle_job_event)
+
     draw_faces_window.protocol("WM_DELETE_WINDOW", return_to_dashboard)
     
 def return_to_dashboard():
@@ -340,4 +365,10 @@ def close_draw_faces():
 # Register the function in login.py
 l.set_notify_callback(open_dashboard)
 
+# Workspaces left behind by an earlier crash
+remove_stale()
+
+# Load TensorFlow, the VAE and the face model once the login window is up
+l.set_shown_callback(warmup.start)
+
 l.show_login_page()
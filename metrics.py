@@ -0,0 +1,129 @@
+import json
+import time
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+
+#  Histogram bucket upper bounds in seconds, Prometheus style
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+class Histogram:
+    """Running count, sum and cumulative bucket counts of observed durations."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            running += count
+            cumulative["+Inf" if bound == float("inf") else str(bound)] = running
+        return {
+            "count": self.count,
+            "sum_s": self.sum,
+            "mean_s": self.sum / self.count if self.count else 0.0,
+            "max_s": self.max,
+            "buckets": cumulative,
+        }
+
+class Tracer:
+    """Collects nested timing spans into per-stage histograms and optional per-query JSONL traces."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.trace_file = None
+
+    def set_trace_file(self, path):
+        """Writes every finished top-level span (one query) as a JSON line to path; None disables it."""
+        self.trace_file = path
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Times the enclosed block as a child of whatever span is currently open on this thread."""
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+
+        record = {"name": name, "start": time.time(), "children": []}
+        if attributes:
+            record["attributes"] = attributes
+        if stack:
+            stack[-1]["children"].append(record)
+        stack.append(record)
+
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            record["duration_ms"] = duration * 1000
+            stack.pop()
+            self.observe(name, duration)
+            if not stack:
+                self._write_trace(record)
+
+    def traced(self, name):
+        """Decorator form of span()."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def _write_trace(self, record):
+        if not self.trace_file:
+            return
+        try:
+            with self.lock, open(self.trace_file, "a") as file:
+                file.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Could not write trace to '{self.trace_file}': {e}")
+
+    def snapshot(self):
+        """All stage histograms as a JSON-friendly dict."""
+        with self.lock:
+            return {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())}
+
+    def prometheus_text(self, metric="sketch2face_stage_duration_seconds"):
+        """All stage histograms in the Prometheus text exposition format."""
+        lines = [f"# HELP {metric} Time spent in each pipeline stage.", f"# TYPE {metric} histogram"]
+        for name, data in self.snapshot().items():
+            for bound, count in data["buckets"].items():
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {data["sum_s"]}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {data["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+#  Shared tracer used across the pipeline
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
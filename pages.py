@@ -1,18 +1,43 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
-import json
-from PIL import Image, ImageTk
+from records import get_store
 import os
 import shutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from warmup import warmup
+from thumbnails import thumbnail_service
 
-JSON_FILE = "criminal_records.json"
 IMAGE_DIR = "Kaggle/photos/"
 
+# Records table layout
+COLUMN_HEADERS = ["No.", "Name", "Face (Photo)", "Crime", "Edit"]
+COLUMN_WIDTHS = [70, 320, 140, 320, 100]
+ROW_HEIGHT = 150  # 120px photo plus padding and the separator line
+THUMBNAIL_SIZE = (120, 120)
+PAGE_SIZE = 100  # Records fetched from the store at a time
+MAX_CACHED_PAGES = 20
+
+# New photos are embedded one at a time in the background, so saving a record returns at once
+index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="photo-index")
+
+def unique_photo_name(filename):
+    """filename, or filename with a numeric suffix if a record or gallery photo already uses it.
+
+    Records are keyed by photo, so reusing a name would overwrite another suspect's record.
+    """
+    stem, extension = os.path.splitext(filename)
+    candidate, number = filename, 1
+    while get_store().find_by_photo(candidate) or os.path.exists(os.path.join(IMAGE_DIR, candidate)):
+        number += 1
+        candidate = f"{stem}_{number}{extension}"
+    return candidate
+
 def add_criminal_record(dashboard_window):
     """Opens a full-screen window to add a new criminal record."""
 
     def save_record():
-        """Validates input and saves the record to JSON."""
+        """Validates input and saves the record to the records database."""
         name = name_entry.get().strip()
         crime = crime_entry.get().strip()
         image_path = image_entry.get().strip()
@@ -25,8 +50,8 @@ def add_criminal_record(dashboard_window):
         if not os.path.exists(IMAGE_DIR):
             os.makedirs(IMAGE_DIR)
 
-        # Copy image to Kaggle/photos/ directory
-        image_filename = os.path.basename(image_path)
+        # Copy image to Kaggle/photos/ directory, renamed if another record or photo already uses its name
+        image_filename = unique_photo_name(os.path.basename(image_path))
         destination_path = os.path.join(IMAGE_DIR, image_filename)
 
         try:
@@ -35,20 +60,15 @@ def add_criminal_record(dashboard_window):
             messagebox.showerror("Error", f"Failed to copy image: {e}")
             return
 
-        # Load existing records
+        # Add new record (a single indexed insert, however many records exist)
         try:
-            with open(JSON_FILE, "r") as file:
-                records = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            records = []
-
-        # Add new record
-        new_record = {"name": name, "crime": crime, "photo": image_filename}
-        records.append(new_record)
+            get_store().add(name, crime, image_filename)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save record: {e}")
+            return
 
-        # Save updated records back to the JSON file
-        with open(JSON_FILE, "w") as file:
-            json.dump(records, file, indent=4)
+        # Make the new suspect searchable right away instead of on the next full gallery scan
+        index_executor.submit(index_new_photo, image_filename)
 
         # Show success message
         messagebox.showinfo("Success", "Criminal record added successfully!")
@@ -104,18 +124,119 @@ def add_criminal_record(dashboard_window):
 
     add_window.mainloop()
 
-def load_records():
-    """Loads criminal records from a JSON file."""
-    if not os.path.exists(JSON_FILE):
-        messagebox.showerror("Error", "Criminal records file not found!")
+def index_new_photo(image_filename):
+    """Background job: indexes a newly added gallery photo once the models are loaded."""
+    warmup.wait()
+    import compare
+    return compare.index_photo(image_filename, compare.IMAGE_FOLDER)
+
+def load_records(offset=0, limit=None):
+    """Loads criminal records from the records database, optionally one page at a time."""
+    try:
+        return get_store().all(offset, limit)
+    except Exception as e:
+        messagebox.showerror("Error", f"Could not load criminal records: {e}")
         return []
 
-    with open(JSON_FILE, "r") as file:
-        try:
-            return json.load(file)
-        except json.JSONDecodeError:
-            messagebox.showerror("Error", "Invalid JSON format!")
-            return []
+class RecordsTable:
+    """Virtualized records table: widgets exist only for the visible rows and are reused while scrolling.
+
+    Records are fetched from the store a page at a time and photos are only requested for rows on screen.
+    """
+
+    def __init__(self, parent, store):
+        self.store = store
+        self.total = store.count()
+        self.pages = OrderedDict()   # page number -> records (most recently used last)
+        self.rows = []  # Reusable row widgets
+
+        # Fixed header, outside the scrolling area
+        header = tk.Frame(parent, bg="#f0f0f0")
+        header.pack(fill="x")
+        for col, (text, width) in enumerate(zip(COLUMN_HEADERS, COLUMN_WIDTHS)):
+            header.grid_columnconfigure(col, minsize=width)
+            tk.Label(header, text=text, font=("Arial", 14, "bold"), bg="#ccc", padx=10, pady=5, borderwidth=2, relief="solid").grid(row=0, column=col, sticky="nsew", padx=2, pady=2)
+
+        body = tk.Frame(parent, bg="#f0f0f0")
+        body.pack(fill="both", expand=True)
+        self.canvas = tk.Canvas(body, bg="#f0f0f0", highlightthickness=0, yscrollincrement=ROW_HEIGHT)
+        self.scrollbar = tk.Scrollbar(body, orient="vertical", command=self.canvas.yview, width=20)  # Increased scrollbar width
+        self.canvas.configure(yscrollcommand=self.on_scroll, scrollregion=(0, 0, sum(COLUMN_WIDTHS), self.total * ROW_HEIGHT))
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.canvas.bind("<Configure>", lambda e: self.render())
+        # Mouse wheel scrolls one row per notch anywhere in the window (Windows/macOS, then X11)
+        window = parent.winfo_toplevel()
+        window.bind("<MouseWheel>", lambda e: self.canvas.yview_scroll(-1 if e.delta > 0 else 1, "units"))
+        window.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-1, "units"))
+        window.bind("<Button-5>", lambda e: self.canvas.yview_scroll(1, "units"))
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.render()
+
+    def record(self, index):
+        """Record at a 0-based position, loading its page from the store if needed."""
+        page = index // PAGE_SIZE
+        if page not in self.pages:
+            self.pages[page] = load_records(page * PAGE_SIZE, PAGE_SIZE)
+            if len(self.pages) > MAX_CACHED_PAGES:
+                self.pages.popitem(last=False)
+        self.pages.move_to_end(page)
+        records = self.pages[page]
+        offset = index - page * PAGE_SIZE
+        return records[offset] if offset < len(records) else None
+
+    def make_row(self):
+        """Creates one reusable row: No., Name, Face (Photo), Crime and Edit cells plus a separator."""
+        frame = tk.Frame(self.canvas, bg="#f0f0f0")
+        for col, width in enumerate(COLUMN_WIDTHS):
+            frame.grid_columnconfigure(col, minsize=width)
+        cells = {
+            "number": tk.Label(frame, font=("Arial", 12), bg="#ffffff", padx=10, pady=5, borderwidth=1, relief="solid"),
+            "name": tk.Label(frame, font=("Arial", 12), bg="#ffffff", padx=10, pady=5, borderwidth=1, relief="solid", wraplength=COLUMN_WIDTHS[1] - 20),
+            "photo": tk.Label(frame, bg="#ffffff", borderwidth=1, relief="solid"),
+            "crime": tk.Label(frame, font=("Arial", 12), bg="#ffffff", padx=10, pady=5, borderwidth=1, relief="solid", wraplength=COLUMN_WIDTHS[3] - 20),
+            "edit": tk.Button(frame, text="Edit", font=("Arial", 12, "bold"), bg="#ffcc00"),
+        }
+        for col, cell in enumerate(cells.values()):
+            cell.grid(row=0, column=col, sticky="nsew", padx=2, pady=2)
+        frame.grid_rowconfigure(0, minsize=ROW_HEIGHT - 15)
+
+        # Thick Black Separator Line
+        tk.Frame(frame, height=3, bg="black").grid(row=1, column=0, columnspan=len(COLUMN_WIDTHS), sticky="ew", padx=5, pady=5)
+
+        item = self.canvas.create_window(0, 0, window=frame, anchor="nw", width=sum(COLUMN_WIDTHS), height=ROW_HEIGHT)
+        self.rows.append((item, cells))
+
+    def render(self):
+        """Moves the pooled rows to the records currently in view and fills them in."""
+        visible = self.canvas.winfo_height() // ROW_HEIGHT + 2
+        while len(self.rows) < min(visible, self.total):
+            self.make_row()
+
+        first = int(self.canvas.canvasy(0)) // ROW_HEIGHT
+        for offset, (item, cells) in enumerate(self.rows):
+            index = first + offset
+            record = self.record(index) if index < self.total else None
+            if record is None:
+                self.canvas.itemconfigure(item, state="hidden")
+                continue
+
+            name = record.get("name", "Unknown")
+            photo_filename = record.get("photo", "")
+            img_path = os.path.join(IMAGE_DIR, photo_filename) if photo_filename else None
+            cells["number"].config(text=str(index + 1))
+            cells["name"].config(text=name)
+            # Photos decode in the background; rows already showing this photo are left alone
+            if getattr(cells["photo"], "thumbnail_request", None) != (img_path, THUMBNAIL_SIZE):
+                thumbnail_service.show(cells["photo"], img_path, THUMBNAIL_SIZE, missing_text="")
+            cells["crime"].config(text=record.get("crime", "Unknown"))
+            cells["edit"].config(command=lambda n=name: print(f"Edit {n}"))
+            self.canvas.coords(item, 0, index * ROW_HEIGHT)
+            self.canvas.itemconfigure(item, state="normal")
+
 #'''
 def view_records():
     """Opens the View Records window and displays data in a table format with images."""
@@ -124,92 +245,26 @@ def view_records():
     records_window.state('zoomed')  # Full-screen mode
     records_window.configure(bg="#f0f0f0")
 
-    # Set the dimensions of the table_frame as a percentage of the window size
+    # Center the fixed-width table on the screen
     window_width = records_window.winfo_screenwidth()
-    window_height = records_window.winfo_screenheight()
-
-    # Define percentages (for example, 80% of the window width and 80% of the window height)
-    table_width_percentage = 0.8  # 80% of the screen width
-    table_height_percentage = 0.8  # 80% of the screen height
-
-    table_width = int(window_width * table_width_percentage)
-    table_height = int(window_height * table_height_percentage)
-    padx = window_width // 4
+    padx = max(10, (window_width - sum(COLUMN_WIDTHS)) // 2)
 
     # Title Label
     title_label = tk.Label(records_window, text="Criminal Records", font=("Arial", 20, "bold"), bg="#f0f0f0")
     title_label.pack(pady=20)
 
-    table_frame = tk.Frame(records_window, bg="#f0f0f0", width=table_width, height=table_height)
+    table_frame = tk.Frame(records_window, bg="#f0f0f0")
     table_frame.pack(padx=padx, pady=10, fill="both", expand=True)
 
-    canvas = tk.Canvas(table_frame, bg="#f0f0f0")
-    scrollbar = tk.Scrollbar(table_frame, orient="vertical", command=canvas.yview, width=20)  # Increased scrollbar width
-    scrollable_frame = tk.Frame(canvas, bg="#f0f0f0")
-
-    scrollable_frame.bind(
-        "<Configure>",
-        lambda e: canvas.configure(
-            scrollregion=canvas.bbox("all")
-        )
-    )
-
-    canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-    canvas.configure(yscrollcommand=scrollbar.set)
-
-    canvas.pack(side="left", fill="both", expand=True)
-    scrollbar.pack(side="right", fill="y")
-
-    # Load records
-    records = load_records()
-    images = {}  # Store image references
-
-    # Table Header
-    headers = ["No.", "Name", "Face (Photo)", "Crime", "Edit"]
-    for col, header in enumerate(headers):
-        tk.Label(scrollable_frame, text=header, font=("Arial", 14, "bold"), bg="#ccc", padx=10, pady=5, borderwidth=2, relief="solid").grid(row=0, column=col, sticky="nsew", padx=2, pady=2)
-
-    row_num = 1  # Start from row 1 after the header
-
-    # Insert data
-    for index, record in enumerate(records, start=1):
-        name = record.get("name", "Unknown")
-        crime = record.get("crime", "Unknown")
-        photo_filename = record.get("photo", "")
+    try:
+        store = get_store()
+    except Exception as e:
+        messagebox.showerror("Error", f"Could not load criminal records: {e}")
+        records_window.destroy()
+        return
 
-        img_path = os.path.join(IMAGE_DIR, photo_filename)
-        if os.path.exists(img_path):
-            img = Image.open(img_path).resize((120, 120), Image.Resampling.LANCZOS)
-            img = ImageTk.PhotoImage(img)
-            images[index] = img  # Store reference
-        else:
-            img = None
-
-        # Create 5 rows for each record
-        for i in range(5):
-            for col in range(5):
-                if col == 2:  # Face (Photo) column
-                    if img and i == 0:  # Place the image only in the first row
-                        tk.Label(scrollable_frame, image=img, bg="#ffffff", borderwidth=1, relief="solid").grid(row=row_num, column=col, rowspan=5, sticky="nsew", padx=2, pady=2)
-                elif i == 2:  # Middle row (3rd row) to display data
-                    if col == 0:  # No.
-                        tk.Label(scrollable_frame, text=str(index), font=("Arial", 12), bg="#ffffff", padx=10, pady=5, borderwidth=1, relief="solid").grid(row=row_num, column=col, sticky="nsew", padx=2, pady=2)
-                    elif col == 1:  # Name
-                        tk.Label(scrollable_frame, text=name, font=("Arial", 12), bg="#ffffff", padx=10, pady=5, borderwidth=1, relief="solid").grid(row=row_num, column=col, sticky="nsew", padx=2, pady=2)
-                    elif col == 3:  # Crime
-                        tk.Label(scrollable_frame, text=crime, font=("Arial", 12), bg="#ffffff", padx=10, pady=5, borderwidth=1, relief="solid").grid(row=row_num, column=col, sticky="nsew", padx=2, pady=2)
-                    elif col == 4:  # Edit Button
-                        edit_button = tk.Button(scrollable_frame, text="Edit", font=("Arial", 12, "bold"), bg="#ffcc00", command=lambda n=name: print(f"Edit {n}"))
-                        edit_button.grid(row=row_num, column=col, sticky="nsew", padx=2, pady=2)
-                else:  # Empty spaces in rows 1, 2, 4, 5 for alignment
-                    if col in [0, 1, 3, 4]:  # No., Name, Crime, Edit columns
-                        tk.Label(scrollable_frame, text=" ", bg="#ffffff", borderwidth=1, relief="solid").grid(row=row_num, column=col, sticky="nsew", padx=2, pady=2)
-
-            row_num += 1  # Move to next row
-
-        # Thick Black Separator Line
-        tk.Frame(scrollable_frame, height=3, bg="black").grid(row=row_num, column=0, columnspan=5, sticky="ew", padx=5, pady=5)
-        row_num += 1  # Move to the next row after the separator
+    # Only the rows on screen get widgets, so opening the window does not depend on the number of records
+    records_window.table = RecordsTable(table_frame, store)
 
     records_window.mainloop()
 '''
@@ -0,0 +1,77 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+CACHE_DIR = "cache/reconstructions"
+MAX_CACHE_BYTES = 256 * 1024 * 1024  # 256 MB
+
+def cache_key(sketch_path, **params):
+    """Hashes the sketch bytes together with the model and sampling parameters."""
+    digest = hashlib.sha256()
+    with open(sketch_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+class ReconstructionCache:
+    """On-disk store of reconstructed images with size-based LRU eviction."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, extension=".png"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.lock = threading.Lock()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key + self.extension)
+
+    def get(self, key):
+        """Returns the cached file path for a key, or None; a hit marks the entry as recently used."""
+        path = self.path_for(key)
+        with self.lock:
+            if not os.path.exists(path):
+                return None
+            os.utime(path)  # LRU order is kept in the file mtime
+        return path
+
+    def put_data(self, key, data):
+        """Stores an already encoded reconstruction and evicts the least recently used entries."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path_for(key)
+        tmp_path = path + ".tmp"
+
+        with self.lock:
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+            self._evict()
+        return path
+
+    def _evict(self):
+        """Removes the oldest entries until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.extension):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                print(f"Could not evict cached reconstruction '{path}': {e}")
+
+    def clear(self):
+        """Deletes every cached reconstruction."""
+        with self.lock:
+            if os.path.exists(self.cache_dir):
+                shutil.rmtree(self.cache_dir)
@@ -1,6 +1,7 @@
 import os
 import json
 import random
+from records import get_store
 
 # Directories and file listing
 photos_dir = r'Kaggle/photos/'
@@ -51,9 +52,14 @@ for file in photo_files:
         count += 1 
         print(count)
 
-# Save to JSON file
+# Save to JSON file (only imported into a fresh records database)
 output_file = 'criminal_records.json'
 with open(output_file, 'w') as f:
     json.dump(records, f, indent=4)
 
 print(f"Criminal records saved to {output_file}")
+
+# The app reads the SQLite store, so write the records there too (replacing those for the same photos)
+store = get_store()
+store.add_many(records)
+print(f"Criminal records saved to {store.db_file} ({store.count()} records)")
@@ -0,0 +1,123 @@
+import os
+import json
+import sqlite3
+import threading
+
+DB_FILE = "criminal_records.db"
+JSON_FILE = "criminal_records.json"
+FIELDS = ("name", "crime", "photo")
+SCHEMA_VERSION = 1  # Stored in PRAGMA user_version once the JSON file has been imported
+
+class RecordStore:
+    """Criminal records in an indexed SQLite table (unique on photo, indexed on name and crime).
+
+    Each thread gets its own connection; WAL mode lets readers run while a record is being added.
+    """
+
+    def __init__(self, db_file=DB_FILE, json_file=JSON_FILE):
+        self.db_file = db_file
+        self.local = threading.local()
+        self.setup()
+
+        #  One-time import of the legacy JSON file into a fresh database
+        conn = self.connection()
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            if json_file and os.path.exists(json_file):
+                self.import_json(json_file)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def connection(self):
+        """This thread's connection, opened on first use."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def setup(self):
+        """Creates the records table and its indexes if they do not exist."""
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS records (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    crime TEXT NOT NULL,
+                    photo TEXT NOT NULL
+                )
+            ''')
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_records_photo ON records (photo)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_records_name ON records (name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_records_crime ON records (crime)")
+
+    def add(self, name, crime, photo):
+        """Adds a record; a record that already exists for the photo is replaced."""
+        self.add_many([{"name": name, "crime": crime, "photo": photo}])
+
+    def add_many(self, records):
+        """Adds (or replaces, by photo) many records in a single transaction; returns the count."""
+        rows = [tuple(record[field] for field in FIELDS) for record in records]
+        with self.connection() as conn:
+            conn.executemany('''
+                INSERT INTO records (name, crime, photo) VALUES (?, ?, ?)
+                ON CONFLICT (photo) DO UPDATE SET name = excluded.name, crime = excluded.crime
+            ''', rows)
+        return len(rows)
+
+    def import_json(self, json_file=JSON_FILE):
+        """Imports every record of a criminal_records.json file; returns the count."""
+        try:
+            with open(json_file, "r") as file:
+                records = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not import criminal records from '{json_file}': {e}")
+            return 0
+        count = self.add_many(record for record in records if all(field in record for field in FIELDS))
+        print(f"Imported {count} criminal records from '{json_file}'.")
+        return count
+
+    def find_by_photo(self, photo):
+        """The record for a gallery photo filename, or None."""
+        row = self.connection().execute(
+            "SELECT name, crime, photo FROM records WHERE photo = ?", (photo,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def find(self, name=None, crime=None):
+        """Records with the given name and/or crime."""
+        clauses, params = [], []
+        for field, value in (("name", name), ("crime", crime)):
+            if value is not None:
+                clauses.append(f"{field} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.connection().execute(f"SELECT name, crime, photo FROM records{where} ORDER BY id", params)
+        return [dict(row) for row in rows]
+
+    def all(self, offset=0, limit=None):
+        """Records in insertion order, optionally one page at a time."""
+        rows = self.connection().execute(
+            "SELECT name, crime, photo FROM records ORDER BY id LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset),
+        )
+        return [dict(row) for row in rows]
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Returns the shared RecordStore, creating (and, the first time, importing) it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RecordStore()
+        return _store
+
+if __name__ == "__main__":
+    store = get_store()
+    print(f"{store.count()} criminal records in '{store.db_file}'.")
@@ -1,10 +1,14 @@
+import io
+import os
+import heapq
 import numpy as np
-import matplotlib.pyplot as plt
+from PIL import Image
 import tensorflow.keras.backend as K
-from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing import image
 from tensorflow.keras.saving import register_keras_serializable
-from skimage.metrics import structural_similarity as ssim
+from reconstruction_cache import ReconstructionCache, cache_key
+from inference_engine import load_engine
+from metrics import span, traced
 
 # Register custom sampling function
 @register_keras_serializable(package="Custom")
@@ -14,39 +18,190 @@ def sampling(args):
     return z_mean + K.exp(z_log_sigma / 2) * epsilon
 
 # Load the trained VAE model
-vae_model = load_model("vae_2skf_best_model.h5", custom_objects={"sampling": sampling}, compile=False)
+MODEL_PATH = "vae_2skf_best_model.h5"
+INFERENCE_BACKEND = "savedmodel"  # "keras" (eager .h5), "savedmodel" or "tflite"
+JIT_COMPILE = False               # XLA-compile the traced graphs
+QUANTIZATION = None               # TFLite only: None, "float16" or "int8"
 
-def generate_best_reconstruction(img_path):
-    """Generates and returns the best reconstructed image using VAE."""
+vae_engine = load_engine(MODEL_PATH, {"sampling": sampling}, INFERENCE_BACKEND, JIT_COMPILE, QUANTIZATION)
 
-    # Load and preprocess sketch
-    img = image.load_img(img_path, target_size=(256, 256))
+reconstruction_cache = ReconstructionCache()
+
+NUM_SAMPLES = 50  # Candidate reconstructions per sketch
+BATCH_SIZE = 25   # Samples decoded per forward pass
+
+GRAY_WEIGHTS = np.array([0.2989, 0.5870, 0.1140])
+SSIM_WIN_SIZE = 7  # Same window and constants as skimage's structural_similarity defaults
+SSIM_K1, SSIM_K2 = 0.01, 0.03
+
+def iter_reconstructions(img_array, num_samples=NUM_SAMPLES, batch_size=BATCH_SIZE, reuse_latent=True):
+    """Yields batches of reconstructions of one preprocessed sketch, num_samples in total.
+
+    With reuse_latent the encoder runs once and only the latent sampling and decoder
+    are repeated; otherwise the sketch is tiled and the full VAE runs on each batch.
+    """
+    reuse_latent = reuse_latent and vae_engine.has_latent
+
+    if reuse_latent:
+        with span("vae_encode"):
+            z_mean, z_log_sigma = vae_engine.encode(img_array)
+
+    for start in range(0, num_samples, batch_size):
+        n = min(batch_size, num_samples - start)
+        with span("vae_decode", samples=n):
+            if reuse_latent:
+                #  Same reparameterisation as the `sampling` layer, drawn n times
+                epsilon = np.random.normal(size=(n, z_mean.shape[1])).astype("float32")
+                z = z_mean + np.exp(z_log_sigma / 2) * epsilon
+                decode = vae_engine.decode(z)
+            else:
+                decode = vae_engine.reconstruct(np.repeat(img_array, n, axis=0))
+            decode = np.clip(np.asarray(decode), 0, 1)
+        yield decode
+
+def _box_mean(x, size):
+    """Mean over every fully-contained size x size window of a (N, H, W) batch."""
+    c = np.cumsum(np.cumsum(x, axis=1), axis=2)
+    c = np.pad(c, ((0, 0), (1, 0), (1, 0)))
+    total = c[:, size:, size:] - c[:, :-size, size:] - c[:, size:, :-size] + c[:, :-size, :-size]
+    return total / (size * size)
+
+def batch_ssim(reference_gray, batch_gray, win_size=SSIM_WIN_SIZE):
+    """SSIM of each image in a (N, H, W) batch against one (H, W) reference.
+
+    Matches skimage's structural_similarity with its default uniform window, sample
+    covariance and a per-candidate data_range of max - min.
+    """
+    x = np.asarray(reference_gray, dtype=np.float64)[None]
+    y = np.asarray(batch_gray, dtype=np.float64)
+
+    data_range = y.max(axis=(1, 2)) - y.min(axis=(1, 2))
+    c1 = ((SSIM_K1 * data_range) ** 2)[:, None, None]
+    c2 = ((SSIM_K2 * data_range) ** 2)[:, None, None]
+    cov_norm = win_size ** 2 / (win_size ** 2 - 1)
+
+    ux, uy = _box_mean(x, win_size), _box_mean(y, win_size)
+    vx = cov_norm * (_box_mean(x * x, win_size) - ux * ux)
+    vy = cov_norm * (_box_mean(y * y, win_size) - uy * uy)
+    vxy = cov_norm * (_box_mean(x * y, win_size) - ux * uy)
+
+    s = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux ** 2 + uy ** 2 + c1) * (vx + vy + c2))
+    return s.mean(axis=(1, 2))
+
+def select_best_reconstructions(original_gray, batches, top_k=1):
+    """Scores reconstruction batches as they arrive and keeps only the top_k as (ssim, image)."""
+    best = []  # min-heap of (score, sequence, image)
+    seen = 0
+
+    for batch in batches:
+        with span("ssim_selection"):
+            scores = np.nan_to_num(batch_ssim(original_gray, np.dot(batch, GRAY_WEIGHTS)), nan=-1.0)
+        for i in np.argsort(scores)[::-1][:top_k]:
+            item = (float(scores[i]), seen + int(i), batch[i].copy())
+            if len(best) < top_k:
+                heapq.heappush(best, item)
+            elif item[0] > best[0][0]:
+                heapq.heapreplace(best, item)
+        seen += len(batch)
+
+    return [(score, img) for score, _, img in sorted(best, key=lambda item: (-item[0], item[1]))]
+
+def load_sketch(source):
+    """Loads a sketch from a path or raw image bytes as a (1, 256, 256, 3) array in [0, 1]."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    img = image.load_img(source, target_size=(256, 256))
     img_array = image.img_to_array(img)
     img_array = np.expand_dims(img_array, axis=0)
-    img_array = img_array.astype("float32") / 255.0
+    return img_array.astype("float32") / 255.0
+
+def reconstruct_batch(img_arrays, num_samples=NUM_SAMPLES, batch_size=BATCH_SIZE):
+    """Best reconstruction of several sketches at once, as a list of (ssim, image) in input order.
+
+    All sketches are encoded in one pass and their latent samples share decoder batches.
+    """
+    batch = np.concatenate(img_arrays)
+    grays = np.dot(batch[..., :3], GRAY_WEIGHTS)
+
+    if not vae_engine.has_latent:
+        return [select_best_reconstructions(grays[i], iter_reconstructions(batch[i:i + 1], num_samples, batch_size))[0]
+                for i in range(len(batch))]
+
+    with span("vae_encode", sketches=len(batch)):
+        z_mean, z_log_sigma = vae_engine.encode(batch)
+    owners = np.repeat(np.arange(len(batch)), num_samples)  # Sketch each latent sample belongs to
+    best = [(-np.inf, None)] * len(batch)
+
+    for start in range(0, len(owners), batch_size):
+        rows = owners[start:start + batch_size]
+        with span("vae_decode", samples=len(rows)):
+            epsilon = np.random.normal(size=(len(rows), z_mean.shape[1])).astype("float32")
+            z = z_mean[rows] + np.exp(z_log_sigma[rows] / 2) * epsilon
+            decoded = np.clip(vae_engine.decode(z), 0, 1)
+
+        with span("ssim_selection"):
+            for i in np.unique(rows):
+                candidates = decoded[rows == i]
+                scores = np.nan_to_num(batch_ssim(grays[i], np.dot(candidates, GRAY_WEIGHTS)), nan=-1.0)
+                j = int(np.argmax(scores))
+                if scores[j] > best[i][0]:
+                    best[i] = (float(scores[j]), candidates[j].copy())
+
+    return best
+
+def _model_signature():
+    """Identifies the loaded VAE weights for cache keys without hashing the whole file."""
+    stat = os.stat(MODEL_PATH)
+    return {"model": os.path.abspath(MODEL_PATH), "size": stat.st_size, "mtime": stat.st_mtime,
+            "backend": vae_engine.name, "quantization": QUANTIZATION}
+
+def save_reconstruction(img, target):
+    """Writes a float RGB image in [0, 1] as PNG to a path or binary file object."""
+    Image.fromarray((np.clip(img, 0, 1) * 255).round().astype(np.uint8)).save(target, format="PNG")
+
+def load_reconstruction(path):
+    """Reads a saved reconstruction back as a float RGB image in [0, 1]."""
+    with Image.open(path) as img:
+        return np.asarray(img.convert("RGB"), dtype=np.float32) / 255.0
+
+@traced("reconstruction")
+def reconstruct_sketch(img_path, num_samples=NUM_SAMPLES, batch_size=BATCH_SIZE, reuse_latent=True, use_cache=True):
+    """Returns the best reconstruction of a sketch as a float RGB image in [0, 1]; only the cache is written."""
+    # Reuse an earlier reconstruction of the same sketch with the same settings
+    if use_cache:
+        with span("cache_lookup"):
+            key = cache_key(img_path, num_samples=num_samples, reuse_latent=reuse_latent, **_model_signature())
+            cached_path = reconstruction_cache.get(key)
+        if cached_path:
+            print("Reusing cached reconstruction.")
+            return load_reconstruction(cached_path)
+
+    # Load and preprocess sketch
+    with span("load_sketch"):
+        img_array = load_sketch(img_path)
 
-    # Generate 5 reconstructed images
-    reconstructions = []
-    for _ in range(50):
-        decode = vae_model.predict(img_array)
-        reconstructions.append(np.clip(decode[0], 0, 1))
+    # Generate candidates in batches and keep a running best by SSIM
+    original_gray = np.dot(img_array[0, :, :, :3], GRAY_WEIGHTS)
+    batches = iter_reconstructions(img_array, num_samples, batch_size, reuse_latent)
+    best_ssim, best_img = select_best_reconstructions(original_gray, batches)[0]
 
-    # Compute SSIM to select the best reconstruction
-    original_gray = np.dot(img_array[0, :, :, :3], [0.2989, 0.5870, 0.1140])
-    best_img, best_ssim = None, -1
+    if use_cache:
+        with span("cache_store"):
+            data = io.BytesIO()
+            save_reconstruction(best_img, data)
+            reconstruction_cache.put_data(key, data.getvalue())
 
-    for recon in reconstructions:
-        recon_gray = np.dot(recon, [0.2989, 0.5870, 0.1140])
-        score = ssim(original_gray, recon_gray, data_range=recon_gray.max() - recon_gray.min())
+    print(f"Best reconstruction selected (SSIM {best_ssim:.4f}).")
+    return best_img
 
-        if score > best_ssim:
-            best_ssim = score
-            best_img = recon
+def generate_best_reconstruction(img_path, output_path, num_samples=NUM_SAMPLES, batch_size=BATCH_SIZE, reuse_latent=True, use_cache=True):
+    """Generates the best reconstructed image using VAE, saves it to output_path and returns that path.
 
-    # Save the best reconstructed image
-    output_path = r"temp\reconstructed_image.png"
-    plt.imsave(output_path, best_img)
+    Callers that go on to match the image should use reconstruct_sketch and skip the file.
+    """
+    best_img = reconstruct_sketch(img_path, num_samples, batch_size, reuse_latent, use_cache)
+    with span("save_reconstruction"):
+        save_reconstruction(best_img, output_path)
 
     print(f"Best reconstructed image saved as '{output_path}'.")
-    print("Will take 2-3 Mins for Searching and Comparing in the Database")
     return output_path
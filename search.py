@@ -0,0 +1,89 @@
+import os
+from collections import namedtuple
+import numpy as np
+
+#  One ranked gallery hit (higher cosine similarity is better, lower L2 distance is better)
+Candidate = namedtuple("Candidate", ["name", "path", "cosine", "distance"])
+
+EPSILON = 1e-12
+
+def normalize_rows(x):
+    """Unit-length rows of a matrix as float32, plus the original row norms."""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=1)
+    return x / np.maximum(norms, EPSILON)[:, None], norms
+
+def l2_from_cosine(cosine, norms, query_norm):
+    """Euclidean distances recovered from cosine similarities: ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b."""
+    squared = norms ** 2 + query_norm ** 2 - 2.0 * cosine * norms * query_norm
+    return np.sqrt(np.maximum(squared, 0.0))
+
+def subset_rows(rows, names):
+    """Sorted gallery row numbers of the given names, skipping names not in the gallery."""
+    return np.array(sorted(rows[name] for name in names if name in rows), dtype=np.int64)
+
+def rank_top_k(names, image_folder, rows, cosine, distance, k):
+    """Ranks the k best of the scored rows by cosine similarity, then by L2 distance.
+
+    rows are gallery row numbers; cosine and distance are aligned with rows.
+    """
+    k = min(k, len(rows))
+    if k <= 0:
+        return []
+
+    #  Partial selection of the k best rows, then sort only those
+    if k < len(rows):
+        top = np.argpartition(-cosine, k - 1)[:k]
+    else:
+        top = np.arange(len(rows))
+    top = top[np.lexsort((distance[top], -cosine[top]))]
+
+    return [
+        Candidate(names[rows[i]], os.path.join(image_folder, names[rows[i]]), float(cosine[i]), float(distance[i]))
+        for i in top
+    ]
+
+class SearchEngine:
+    """Brute-force top-k search that scores a query against the whole gallery in one matrix product."""
+
+    def __init__(self, names, embeddings, image_folder=""):
+        self.names = list(names)
+        self.rows = {name: i for i, name in enumerate(self.names)}
+        self.image_folder = image_folder
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2:
+            embeddings = embeddings.reshape(len(self.names), -1)
+
+        #  Pre-normalize rows once; keep the norms so L2 can be recovered from the same dot products
+        self.norms = np.linalg.norm(embeddings, axis=1)
+        self.normalized = embeddings / np.maximum(self.norms, EPSILON)[:, None]
+
+    @classmethod
+    def from_index(cls, index):
+        """Builds a search engine over an EmbeddingIndex."""
+        return cls(index.names, index.embeddings, index.image_folder)
+
+    def __len__(self):
+        return len(self.names)
+
+    def score(self, query, rows=None):
+        """Returns cosine similarities and Euclidean distances for every gallery row (or only the given rows)."""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query_norm = float(np.linalg.norm(query))
+
+        normalized, norms = (self.normalized, self.norms) if rows is None else (self.normalized[rows], self.norms[rows])
+        cosine = normalized @ (query / max(query_norm, EPSILON))
+        return cosine, l2_from_cosine(cosine, norms, query_norm)
+
+    def search(self, query, k=5, names=None):
+        """Returns the top-k candidates ranked by cosine similarity, then by L2 distance.
+
+        names, if given, limits the search to those gallery photos.
+        """
+        rows = np.arange(len(self.names)) if names is None else subset_rows(self.rows, names)
+        if not len(rows):
+            return []
+
+        cosine, distance = self.score(query, None if names is None else rows)
+        return rank_top_k(self.names, self.image_folder, rows, cosine, distance, k)
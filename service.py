@@ -0,0 +1,214 @@
+import json
+import time
+import queue
+import base64
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import cv2
+import run_model
+import compare
+from compare import to_bgr_uint8
+from metrics import tracer
+
+HOST = "127.0.0.1"
+PORT = 8000
+MAX_BATCH = 8       # Most requests grouped into one forward pass
+MAX_WAIT_MS = 20    # How long the first request of a batch waits for company
+MAX_BODY_BYTES = 20 * 1024 * 1024
+
+class MicroBatcher:
+    """Groups items submitted within a short window and processes them with one batch call.
+
+    batch_fn receives a list of items and must return a list of results in the same order.
+    """
+
+    def __init__(self, batch_fn, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, name="batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.items = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self.worker.start()
+
+    def submit(self, item):
+        """Queues one item and returns a Future for its result."""
+        future = Future()
+        self.items.put((item, future))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _collect(self):
+        """Blocks for the first item, then gathers more until the batch is full or the window closes."""
+        batch = [self.items.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.items.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items, futures = [item for item, _ in batch], [future for _, future in batch]
+            try:
+                results = self.batch_fn(items)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+def encode_png(img):
+    """Encodes a float RGB image in [0, 1] as PNG bytes."""
+    ok, data = cv2.imencode(".png", to_bgr_uint8(img))
+    if not ok:
+        raise ValueError("Could not encode the reconstruction as PNG.")
+    return data.tobytes()
+
+def parse_top_k(value):
+    """Validates the top_k query parameter; a bad value is the client's error."""
+    try:
+        top_k = int(value)
+    except ValueError:
+        raise ValueError(f"top_k must be an integer, got '{value}'.")
+    if top_k < 1:
+        raise ValueError("top_k must be at least 1.")
+    return top_k
+
+def decode_image(data):
+    """Decodes uploaded image bytes into a BGR uint8 array."""
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Request body is not a readable image.")
+    return img
+
+class InferenceService:
+    """Keeps the VAE and face matcher loaded and micro-batches requests across clients."""
+
+    def __init__(self, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.matcher = compare.get_matcher()
+        self.matcher.refresh()
+        self.reconstructor = MicroBatcher(self._reconstruct_batch, max_batch, max_wait_ms, "vae-batcher")
+        self.embedder = MicroBatcher(tracer.traced("embed_batch")(self.matcher.embed_batch), max_batch, max_wait_ms, "embedding-batcher")
+
+    @staticmethod
+    def _reconstruct_batch(img_arrays):
+        with tracer.span("reconstruct_batch", sketches=len(img_arrays)):
+            return [img for _, img in run_model.reconstruct_batch(img_arrays)]
+
+    def reconstruct(self, sketch_bytes):
+        """Returns the best reconstruction of a sketch as a float RGB image."""
+        try:
+            img_array = run_model.load_sketch(sketch_bytes)
+        except OSError as e:  # PIL.UnidentifiedImageError and truncated files: the client sent a bad image
+            raise ValueError(f"Could not decode the sketch: {e}")
+        return self.reconstructor(img_array)
+
+    def match_image(self, bgr_image, top_k=5):
+        """Matches a BGR face image against the gallery."""
+        query = self.embedder(bgr_image)
+        if query is None:
+            return compare.MatchResult(None, [], self.matcher.model_name, error="No valid embedding found.")
+        with tracer.span("match"):
+            return self.matcher.match_embedding(query, top_k, refresh=False, image=bgr_image)
+
+    def refresh(self):
+        """Picks up photos added to the gallery since the service started."""
+        self.matcher.refresh()
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """POST /reconstruct, /match and /reconstruct-match with raw image bytes as the body."""
+
+    service = None
+
+    def _send(self, status, body, content_type="application/json"):
+        if content_type == "application/json":
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length <= 0:
+            raise ValueError("Send the image bytes as the request body.")
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"Image is larger than {MAX_BODY_BYTES} bytes.")
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send(200, {"status": "ok", "gallery_size": len(self.service.matcher.index)})
+        elif path == "/metrics":
+            self._send(200, tracer.prometheus_text().encode(), "text/plain; version=0.0.4")
+        elif path == "/metrics.json":
+            self._send(200, tracer.snapshot())
+        else:
+            self._send(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        try:
+            top_k = parse_top_k(params.get("top_k", ["5"])[0])
+            if url.path == "/reconstruct":
+                img = self.service.reconstruct(self._read_body())
+                self._send(200, encode_png(img), "image/png")
+            elif url.path == "/match":
+                result = self.service.match_image(decode_image(self._read_body()), top_k)
+                self._send(200, result.to_dict())
+            elif url.path == "/reconstruct-match":
+                img = self.service.reconstruct(self._read_body())
+                result = self.service.match_image(to_bgr_uint8(img), top_k)
+                body = result.to_dict()
+                body["reconstruction_png"] = base64.b64encode(encode_png(img)).decode()
+                self._send(200, body)
+            elif url.path == "/refresh":
+                self.service.refresh()
+                self._send(200, {"gallery_size": len(self.service.matcher.index)})
+            else:
+                self._send(404, {"error": "Not found"})
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            print(f"Error handling {url.path}: {e}")
+            self._send(500, {"error": str(e)})
+
+def serve(host=HOST, port=PORT, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, trace_file=None):
+    """Loads the models and serves requests until interrupted."""
+    tracer.set_trace_file(trace_file)
+    RequestHandler.service = InferenceService(max_batch, max_wait_ms)
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    print(f"Sketch2Face service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve sketch reconstruction and face matching over HTTP.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--trace-file", default=None, help="Append per-request traces to this JSONL file")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.max_batch, args.max_wait_ms, args.trace_file)
@@ -0,0 +1,140 @@
+import os
+import queue
+import threading
+import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageTk
+from reconstruction_cache import cache_key
+
+CACHE_DIR = "cache/thumbnails"
+MAX_MEMORY_BYTES = 64 * 1024 * 1024  # Decoded pixels kept in memory, 64 MB
+MAX_WORKERS = 4
+POLL_INTERVAL_MS = 30
+PLACEHOLDER_COLOR = "#dddddd"
+
+class ThumbnailService:
+    """Resized images for the GUI, from an in-memory LRU over an on-disk cache keyed by source hash and size.
+
+    Decoding runs on a thread pool; show() puts a placeholder on a label at once and swaps
+    the image in on the Tk thread when it is ready.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_MEMORY_BYTES, max_workers=MAX_WORKERS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()  # (path, mtime, file size, size) -> PIL image, most recently used last
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnail")
+        self.ready = queue.Queue()
+        self.outstanding = 0  # Requests not yet delivered; only touched on the Tk thread
+        self.polling = set()  # Tk roots with a delivery poll scheduled
+
+    @staticmethod
+    def _memory_key(path, size):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_mtime_ns, stat.st_size, tuple(size)
+
+    def cached(self, path, size):
+        """The resized image if it is already in memory, else None."""
+        key = self._memory_key(path, size)
+        with self.lock:
+            img = self.memory.get(key)
+            if img is not None:
+                self.memory.move_to_end(key)
+            return img
+
+    def load(self, path, size):
+        """Returns path resized to size, from memory, the disk cache or by decoding it (blocking)."""
+        img = self.cached(path, size)
+        if img is not None:
+            return img
+
+        size = tuple(size)
+        cached_path = os.path.join(self.cache_dir, cache_key(path, size=size, resample="lanczos") + ".png")
+        try:
+            img = Image.open(cached_path)
+            img.load()
+        except OSError:
+            img = Image.open(path)
+            img.draft("RGB", size)  # Lets JPEG decode straight at a reduced scale
+            img = img.convert("RGB").resize(size, Image.Resampling.LANCZOS)
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+            img.save(tmp_path, "PNG")
+            os.replace(tmp_path, cached_path)
+
+        key = self._memory_key(path, size)
+        with self.lock:
+            if key not in self.memory:
+                self.memory[key] = img
+                self.memory_bytes += size[0] * size[1] * 3
+            while self.memory_bytes > self.max_bytes and len(self.memory) > 1:
+                _, old = self.memory.popitem(last=False)
+                self.memory_bytes -= old.width * old.height * 3
+        return img
+
+    def show(self, label, path, size, missing_text="No Image Found"):
+        """Shows path on label at size: at once if it is in memory, else a placeholder until it is decoded."""
+        size = tuple(size)
+        label.thumbnail_request = (path, size)
+        if not path or not os.path.exists(path):
+            self._apply(label, path, size, None, missing_text)
+            return
+
+        img = self.cached(path, size)
+        if img is not None:
+            self._apply(label, path, size, img, missing_text)
+            return
+
+        placeholder = ImageTk.PhotoImage(Image.new("RGB", size, PLACEHOLDER_COLOR), master=label)
+        label.config(image=placeholder, text="")
+        label.image = placeholder
+
+        self.outstanding += 1
+        future = self.executor.submit(self.load, path, size)
+        future.add_done_callback(lambda f: self.ready.put((label, path, size, missing_text, f)))
+        self._schedule(label._root())
+
+    def _apply(self, label, path, size, img, missing_text):
+        #  Skip results for labels that have moved on to another image since the request
+        if getattr(label, "thumbnail_request", None) != (path, size):
+            return
+        if img is None:
+            label.config(image="", text=missing_text)
+            label.image = None
+            return
+        photo = ImageTk.PhotoImage(img, master=label)
+        label.config(image=photo, text="")
+        label.image = photo  # Keep a reference to prevent garbage collection
+
+    def _schedule(self, root):
+        if root not in self.polling:
+            self.polling.add(root)
+            root.after(POLL_INTERVAL_MS, self._deliver, root)
+
+    def _deliver(self, root):
+        """Swaps finished images in on the Tk thread and keeps polling while requests are outstanding."""
+        self.polling.discard(root)
+        while True:
+            try:
+                label, path, size, missing_text, future = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            self.outstanding -= 1
+            try:
+                img = future.result()
+            except Exception as e:
+                print(f"Could not load image '{path}': {e}")
+                img = None
+            try:
+                self._apply(label, path, size, img, missing_text)
+            except tk.TclError:
+                pass  # The label was destroyed while its image was loading
+        if self.outstanding > 0:
+            self._schedule(root)
+
+#  Shared service used by every GUI view
+thumbnail_service = ThumbnailService()
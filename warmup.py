@@ -0,0 +1,78 @@
+import time
+import importlib
+import threading
+
+POLL_INTERVAL_MS = 250
+
+class WarmUp:
+    """Imports the ML stack and loads the models on a background thread after the GUI is up.
+
+    Stages run in order; ``stage`` names the one in progress and ``ready`` is set once all have
+    finished. A failure is kept in ``error`` and still releases anyone waiting.
+    """
+
+    def __init__(self):
+        self.stage = None
+        self.error = None
+        self.timings = {}  # stage -> seconds
+        self.ready = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def stages(self):
+        """(label, callable) pairs, heaviest imports first so later stages find them cached."""
+        return [
+            ("loading TensorFlow", lambda: importlib.import_module("tensorflow")),
+            ("loading reconstruction model", lambda: importlib.import_module("run_model")),
+            ("loading face model", lambda: importlib.import_module("compare").get_matcher()),
+            ("indexing gallery", lambda: importlib.import_module("compare").get_matcher().refresh()),
+        ]
+
+    def start(self):
+        """Starts the warm-up once; later calls do nothing."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        try:
+            for label, load in self.stages():
+                self.stage = label
+                start = time.perf_counter()
+                load()
+                self.timings[label] = time.perf_counter() - start
+                print(f"Warm-up: {label} took {self.timings[label]:.1f}s")
+        except Exception as e:
+            self.error = e
+            print(f"Warm-up failed while {self.stage}: {e}")
+        finally:
+            self.stage = None
+            self.ready.set()
+
+    def wait(self, timeout=None):
+        """Starts the warm-up if needed and blocks until it has finished; returns False on timeout."""
+        self.start()
+        return self.ready.wait(timeout)
+
+    def status(self):
+        """Short human-readable readiness text."""
+        if self.error is not None:
+            return f"Models failed to load: {self.error}"
+        if self.ready.is_set():
+            return "Models ready"
+        return f"Starting up: {self.stage or 'waiting'}..."
+
+def show_status(label, warm_up, interval_ms=POLL_INTERVAL_MS):
+    """Keeps a Tk label showing the warm-up status until it is done (runs on the Tk thread)."""
+    def tick():
+        if not label.winfo_exists():
+            return
+        label.config(text=warm_up.status(), fg="red" if warm_up.error else ("green" if warm_up.ready.is_set() else "orange"))
+        if not warm_up.ready.is_set():
+            label.after(interval_ms, tick)
+
+    tick()
+
+#  Shared warm-up started by the GUI at launch
+warmup = WarmUp()
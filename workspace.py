@@ -0,0 +1,46 @@
+import os
+import time
+import shutil
+import tempfile
+
+WORKSPACE_ROOT = "temp"
+PREFIX = "job-"
+MAX_AGE_SECONDS = 24 * 60 * 60  # Workspaces left behind by a crash are removed after a day
+
+class Workspace:
+    """A private directory for one upload or job's intermediate files, removed when the job is done.
+
+    Each workspace is a fresh, uniquely named directory under temp/, so concurrent jobs never
+    share a file. Use it as a context manager, or call cleanup() once its files are no longer needed.
+    """
+
+    def __init__(self, root=WORKSPACE_ROOT, prefix=PREFIX):
+        os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+
+    def file(self, name):
+        """Path for a file inside the workspace."""
+        return os.path.join(self.path, os.path.basename(name))
+
+    def cleanup(self):
+        """Deletes the workspace and everything in it; safe to call more than once."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+def remove_stale(root=WORKSPACE_ROOT, max_age=MAX_AGE_SECONDS):
+    """Deletes workspaces older than max_age seconds; returns how many were removed."""
+    if not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith(PREFIX) and os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed